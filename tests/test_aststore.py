@@ -0,0 +1,44 @@
+import unittest
+
+import aststore
+import cache
+import parser
+from typing import *
+
+SOURCE = """
+twice f x = f(f(x))
+pick b = if b then lambda x -> x + 1 else lambda y -> y * 2
+cmp x = if x < 10 then x % 3 - 1 else 0
+"""
+
+
+class TestASTStore(unittest.TestCase):
+    def test_round_trip(self):
+        decls = parser.Parser().parse_module(SOURCE)
+        store = aststore.ASTStore()
+        ids = [store.add(decl) for decl in decls]
+        for decl, id in zip(decls, ids):
+            self.assertEqual(cache.decl_hash(store.to_node(id)), cache.decl_hash(decl))
+        self.assertEqual(store.strings.count("x"), 1)
+
+    def test_parse_into_store(self):
+        store = aststore.ASTStore()
+        views = parser.Parser(store).parse_module(SOURCE)
+        self.assertIsInstance(views[0], ast.Decl)
+        self.assertEqual([v.name for v in views], ["twice", "pick", "cmp"])
+        self.assertEqual(views[1].expr.expr.thenexpr.argnames, ["x"])
+        self.assertEqual(views[2].expr.expr, views[2].expr.expr)
+        decls = parser.Parser().parse_module(SOURCE)
+        self.assertEqual([cache.decl_hash(v) for v in views], [cache.decl_hash(d) for d in decls])
+
+    def test_inference_over_views(self):
+        store = aststore.ASTStore()
+        views = parser.Parser(store).parse_module(SOURCE)
+        decls = parser.Parser().parse_module(SOURCE)
+        for view, decl in zip(views, decls):
+            self.assertEqual(str(infer_decls([view])[view.name]),
+                             str(infer_decls([decl])[decl.name]))
+
+
+if __name__ == "__main__":
+    unittest.main()
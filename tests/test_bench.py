@@ -0,0 +1,33 @@
+import random
+import unittest
+
+import bench
+import parser
+
+
+class TestBench(unittest.TestCase):
+    def test_generators_seeded_and_well_formed(self):
+        p = parser.Parser()
+        for name, (generate, sizes) in bench.SHAPES.items():
+            text = generate(random.Random(7), 20)
+            self.assertEqual(text, generate(random.Random(7), 20))
+            if name == "many_decls":
+                self.assertEqual(len(p.parse_module(text)), 20)
+            else:
+                p.parse_decl(text)
+
+    def test_stages(self):
+        text = bench.wide_app(random.Random(0), 50)
+        self.assertEqual(tuple(bench.time_stages(text, repeat=1)), bench.DECL_STAGES)
+        text = bench.many_decls(random.Random(0), 10)
+        self.assertEqual(tuple(bench.time_stages(text, True, repeat=1)), bench.MODULE_STAGES)
+
+    def test_scaling_and_regressions(self):
+        results = {"s/10/parse": 0.01, "s/100/parse": 1.0, "s/10/lex": 0.0001}
+        self.assertAlmostEqual(bench.scaling(results)["s/parse"], 2.0)
+        baseline = {"s/10/parse": 0.01, "s/100/parse": 0.5, "s/10/lex": 0.00001}
+        self.assertEqual(bench.regressions(results, baseline), ["s/100/parse"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import check
+import typing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULE = """
+inc x = x + 1
+twice f x = f(f(x))
+bad = if 1 then 2 else 3
+usesbad x = bad + x
+"""
+
+
+class TestCheck(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        os.mkdir(os.path.join(self.dir.name, "sub"))
+        os.mkdir(os.path.join(self.dir.name, ".hidden"))
+        for i in range(6):
+            self.write(f"sub/m{i}.ti" if i % 2 else f"m{i}.ti",
+                       "".join(f"d{j} x = x * {i} + {j}\n" for j in range(5)))
+        self.write("lib.ti", MODULE)
+        self.write("broken.ti", "f x = x ? 1\n")
+        self.write(".hidden/skipped.ti", "f = 1\n")
+        self.write("notes.txt", "not declarations\n")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, name, text):
+        with open(os.path.join(self.dir.name, name), "w") as f:
+            f.write(text)
+
+    def test_iter_files(self):
+        files = [os.path.relpath(p, self.dir.name)
+                 for p in check.iter_files([self.dir.name], ".ti")]
+        self.assertEqual(files, ["broken.ti", "lib.ti", "m0.ti", "m2.ti", "m4.ti",
+                                 "sub/m1.ti", "sub/m3.ti", "sub/m5.ti"])
+
+    def check_file(self, name):
+        results = []
+        check.check_file(os.path.join(self.dir.name, name), results.append)
+        return results
+
+    def test_check_file(self):
+        results = self.check_file("lib.ti")
+        self.assertEqual(sorted((r["name"], r.get("type"), r.get("error")) for r in results), [
+            ("bad", None, "cannot unify Int :: Bool [from If(1 then 2 else 3)]"),
+            ("inc", "(Int -> Int)", None),
+            ("twice", "(((a -> a), a) -> a)", None),
+            ("usesbad", None, "depends on ill-typed declaration bad"),
+        ])
+        self.assertTrue(all(r["ms"] >= 0 for r in results))
+        self.assertEqual(self.check_file("broken.ti"),
+                         [{"file": os.path.join(self.dir.name, "broken.ti"),
+                           "error": "Lexer error at 1:9 (position 8)"}])
+        self.write("empty_args.ti", "g x = 1\nf = g()\n")
+        error, = self.check_file("empty_args.ti")
+        self.assertIn("non-empty argument list", error["error"])
+        self.assertEqual(self.check_file("missing.ti")[0]["file"],
+                         os.path.join(self.dir.name, "missing.ti"))
+
+    def test_internal_error_isolated(self):
+        infer_decls = typing.infer_decls
+
+        def failing(decls, *args, **kwargs):
+            if decls[0].name == "twice":
+                raise AssertionError("boom")
+            return infer_decls(decls, *args, **kwargs)
+
+        typing.infer_decls = failing
+        try:
+            results = {r["name"]: r for r in self.check_file("lib.ti")}
+        finally:
+            typing.infer_decls = infer_decls
+        self.assertEqual(results["twice"]["error"], "internal error: AssertionError: boom")
+        self.assertEqual(results["inc"]["type"], "(Int -> Int)")
+
+    def test_run(self):
+        out = io.StringIO()
+        checked, failed = check.run([self.dir.name], workers=2, chunksize=2,
+                                    max_in_flight=1, suffix=".ti", out=out)
+        results = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual((checked, failed), (len(results), 3))
+        self.assertEqual(len(results), 6 * 5 + 4 + 1)
+        self.assertEqual({r["type"] for r in results if r["file"].endswith("m4.ti")},
+                         {"(Int -> Int)"})
+
+    def test_worker_killed(self):
+        check_file = check.check_file
+
+        def crashing(path, emit, solver="deferred"):
+            if path.endswith("m2.ti"):
+                os._exit(1)
+            check_file(path, emit, solver)
+
+        out = io.StringIO()
+        check.check_file = crashing
+        try:
+            check.run([self.dir.name], workers=1, chunksize=1, max_in_flight=1,
+                      suffix=".ti", out=out, start_method="fork")
+        finally:
+            check.check_file = check_file
+        results = [json.loads(line) for line in out.getvalue().splitlines()]
+        crashed, = [r for r in results if r["file"].endswith("m2.ti")]
+        self.assertIn("worker failed", crashed["error"])
+        self.assertEqual(len(results), 5 * 5 + 4 + 1 + 1)
+        self.assertEqual({r["type"] for r in results if r["file"].endswith("m5.ti")},
+                         {"(Int -> Int)"})
+
+    def test_worker_killed_mid_batch(self):
+        check_file = check.check_file
+
+        def crashing(path, emit, solver="deferred"):
+            if path.endswith("m4.ti"):
+                # Dies once what the worker has sent is on the pipe.
+                check._results.close()
+                check._results.join_thread()
+                os._exit(1)
+            check_file(path, emit, solver)
+
+        out = io.StringIO()
+        check.check_file = crashing
+        try:
+            check.run([self.dir.name], workers=1, chunksize=3, max_in_flight=1,
+                      suffix=".ti", out=out, start_method="fork")
+        finally:
+            check.check_file = check_file
+        results = [json.loads(line) for line in out.getvalue().splitlines()]
+        failed = sorted(os.path.relpath(r["file"], self.dir.name) for r in results
+                        if "worker failed" in r.get("error", ""))
+        self.assertEqual(failed, ["m4.ti", os.path.join("sub", "m1.ti")])
+        self.assertEqual(len([r for r in results if r["file"].endswith("m2.ti")]), 5)
+        self.assertEqual(len(results), 4 * 5 + 4 + 1 + 2)
+
+    def test_command(self):
+        proc = subprocess.run(
+            [sys.executable, "-m", "type_inference", "check", "-j", "2",
+             "--start-method", "spawn", os.path.join(self.dir.name, "lib.ti")],
+            cwd=ROOT, capture_output=True, text=True)
+        self.assertEqual(proc.returncode, 1, proc.stderr)
+        self.assertEqual(sorted(json.loads(line)["name"] for line in proc.stdout.splitlines()),
+                         ["bad", "inc", "twice", "usesbad"])
+        self.assertIn("checked 4 declarations, 2 errors", proc.stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
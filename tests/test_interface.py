@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+
+import interface
+import module
+import parser
+import typing
+
+LIBRARY = """
+inc x = x + 1
+twice f x = f(f(x))
+compose f g x = f(g(x))
+choose c a b = if c then a else b
+"""
+
+CLIENT = """
+main y = twice(inc, y)
+pick b = choose(b, 1, 2)
+"""
+
+
+class TestInterface(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "lib.tii")
+        self.decls = parser.Parser().parse_module(LIBRARY)
+        self.types, errors = module.infer_module(self.decls, max_workers=1)
+        self.assertEqual(errors, {})
+        interface.write_interface(self.path, self.decls, self.types)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_encode_round_trip(self):
+        for typ in self.types.values():
+            data = interface.encode_type(typ)
+            decoded, end = interface.decode_type(data)
+            self.assertEqual(end, len(data))
+            self.assertEqual(str(decoded), str(typ))
+
+    def test_lookup_decodes_lazily(self):
+        with interface.Interface(self.path) as iface:
+            self.assertEqual(len(iface), 4)
+            self.assertEqual(list(iface), ["choose", "compose", "inc", "twice"])
+            self.assertEqual(iface.decoded, {})
+            self.assertEqual(str(iface["twice"]), "(((a -> a), a) -> a)")
+            self.assertIn("inc", iface)
+            self.assertNotIn("main", iface)
+            self.assertIsNone(iface.get("main"))
+            self.assertEqual(list(iface.decoded), ["twice"])
+
+    def test_dependency_hash(self):
+        with interface.Interface(self.path) as iface:
+            hashes = {name: iface.dep_hash(name) for name in iface}
+        self.assertEqual(len(set(hashes.values())), 4)
+        decl = self.decls[1]
+        self.assertEqual(hashes["twice"], interface.dependency_hash(decl, {}))
+        self.assertNotEqual(hashes["twice"], interface.dependency_hash(
+            decl, {"inc": self.types["inc"]}))
+
+    def test_seeds_client_module(self):
+        with interface.Interface(self.path) as iface:
+            types, errors = module.infer_module_source(CLIENT, max_workers=1, env=iface)
+            self.assertEqual(errors, {})
+            self.assertEqual({k: str(v) for k, v in types.items()},
+                             {"main": "(Int -> Int)", "pick": "(Bool -> Int)"})
+            self.assertEqual(sorted(iface.decoded), ["choose", "inc", "twice"])
+
+    def test_seeds_infer_decls(self):
+        with interface.Interface(self.path) as iface:
+            decl = parser.Parser().parse_decl("f x = compose(inc, inc, x)")
+            typ = typing.infer_decls([decl], iface)["f"]
+            self.assertEqual(str(typ), "(Int -> Int)")
+            self.assertEqual(sorted(iface.decoded), ["compose", "inc"])
+
+    def test_rejects_other_files(self):
+        with open(self.path, "wb") as f:
+            f.write(b"not an interface")
+        with self.assertRaises(ValueError):
+            interface.Interface(self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
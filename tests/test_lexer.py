@@ -0,0 +1,119 @@
+import io
+import os
+import tempfile
+import unittest
+
+import lexer
+
+RULES = (
+    ("if", "IF"),
+    ("then", "THEN"),
+    (r"\d+", "INT"),
+    ("->", "ARROW"),
+    (r"\-", "MINUS"),
+    (">=", "GE"),
+    (">", "GT"),
+    (r"[a-zA-Z_]\w*", "ID"),
+)
+
+
+def lex(rules, text):
+    lx = lexer.TrieLexer(rules)
+    names = lx.tables.type_names
+    return [(names[typ], val, pos) for typ, val, pos in lx.tokenize_all(text)]
+
+
+class TestTrieLexer(unittest.TestCase):
+    def test_keywords_longest_match(self):
+        self.assertEqual(lex(RULES, "iffy if then1 then"),
+                         [("ID", "iffy", 0), ("IF", "if", 5),
+                          ("ID", "then1", 8), ("THEN", "then", 14)])
+
+    def test_operators_longest_match(self):
+        self.assertEqual([t[0] for t in lex(RULES, "a->b - c >= 1 > 2")],
+                         ["ID", "ARROW", "ID", "MINUS", "ID", "GE", "INT", "GT", "INT"])
+
+    def test_overlapping_patterns(self):
+        # A pattern sharing a first character with a literal disables the
+        # single-regex fast path; matching must stay longest-match.
+        rules = RULES + ((r"-\d+", "NEG"),)
+        self.assertIsNone(lexer.TrieLexer(rules).tables.regex)
+        self.assertEqual([t[:2] for t in lex(rules, "x -12 - 3 ->")],
+                         [("ID", "x"), ("NEG", "-12"), ("MINUS", "-"),
+                          ("INT", "3"), ("ARROW", "->")])
+
+    def test_token_interface(self):
+        lx = lexer.TrieLexer(RULES)
+        lx.input("  if x  ")
+        self.assertEqual([str(tok) for tok in lx.tokens()],
+                         ["IF(if) @ 2", "ID(x) @ 5"])
+
+    def test_error(self):
+        with self.assertRaises(lexer.LexerError) as cm:
+            lex(RULES, "x ? y")
+        self.assertEqual(cm.exception.pos, 2)
+
+    def test_line_and_column(self):
+        lx = lexer.TrieLexer(RULES)
+        lx.input("if x\n  then\n\n y -> 1")
+        self.assertEqual([(tok.val, tok.line, tok.col) for tok in lx.tokens()],
+                         [("if", 1, 1), ("x", 1, 4), ("then", 2, 3),
+                          ("y", 4, 2), ("->", 4, 4), ("1", 4, 7)])
+
+    def test_chunks_match_whole_input(self):
+        text = "".join(f"if x{i} >= {i}\n  then -> y{i}\n" for i in range(300))
+        lx = lexer.TrieLexer(RULES)
+        lx.input(text)
+        expected = [(t.typ, t.val, t.pos, t.line, t.col) for t in lx.tokens()]
+        for chunk_size in (1, 2, 3, 7, 64, 1 << 20):
+            lx.input_stream(io.StringIO(text), chunk_size)
+            longest = 0
+            toks = []
+            for t in lx.tokens():
+                toks.append((t.typ, t.val, t.pos, t.line, t.col))
+                longest = max(longest, len(lx.buf))
+            self.assertEqual(toks, expected)
+            self.assertLessEqual(longest, min(len(text), 2 * chunk_size + 8 + lx.tables.lookahead))
+
+    def test_longest_match_across_chunks(self):
+        for rules, text in (((("===", "EQQ"), ("=", "EQ"), (r"[a-z]+", "ID")), "a ===b == c"),
+                            (((r"\d+\.\d+", "FLOAT"), (r"\d+", "INT"), (r"\.", "DOT")),
+                             "12.5 3. 4.75")):
+            expected = lex(rules, text)
+            lx = lexer.TrieLexer(rules)
+            names = lx.tables.type_names
+            for chunk_size in (1, 2, 4, 5):
+                lx.input_stream(io.StringIO(text), chunk_size)
+                self.assertEqual([(names[typ], val, pos) for typ, val, pos in lx.tokenize_all()],
+                                 expected)
+
+    def test_file_input(self):
+        text = "x1 -> t\u00e9t\u00e9 >= 12\nthen"
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "source")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+            lx = lexer.TrieLexer(RULES)
+            for chunk_size in (1, 5, 1 << 20):
+                lx.input_file(path, chunk_size)
+                self.assertEqual([(t.val, t.pos, t.line, t.col) for t in lx.tokens()],
+                                 [("x1", 0, 1, 1), ("->", 3, 1, 4), ("t\u00e9t\u00e9", 6, 1, 7),
+                                  (">=", 11, 1, 12), ("12", 14, 1, 15), ("then", 17, 2, 1)])
+            with open(path, "w") as f:
+                pass
+            lx.input_file(path)
+            self.assertEqual(list(lx.tokens()), [])
+
+    def test_error_position_in_stream(self):
+        lx = lexer.TrieLexer(RULES)
+        lx.input_stream(io.BytesIO(b"x\n y ? z"), 2)
+        with self.assertRaises(lexer.LexerError) as cm:
+            list(lx.tokens())
+        self.assertEqual((cm.exception.pos, cm.exception.line, cm.exception.col), (5, 2, 4))
+
+    def test_tables_shared(self):
+        self.assertIs(lexer.TrieLexer(RULES).tables, lexer.TrieLexer(RULES).tables)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import os
+import tempfile
+import unittest
+
+import cache
+import module
+
+SOURCE = """
+inc x = x + 1
+twice f x = f(f(x))
+main y = twice(inc, y)
+even n = if n == 0 then true else odd(n - 1)
+odd n = if n == 0 then false else even(n - 1)
+bad = if 1 then 2 else 3
+usesbad x = bad + x
+"""
+
+
+class TestModule(unittest.TestCase):
+    def test_sccs_in_dependency_order(self):
+        graph = {"a": ["b"], "b": ["c"], "c": ["b"], "d": []}
+        self.assertEqual(module.strongly_connected_components(graph),
+                         [["b", "c"], ["a"], ["d"]])
+
+    def check(self, types, errors):
+        self.assertEqual({k: str(v) for k, v in types.items()}, {
+            "inc": "(Int -> Int)",
+            "twice": "(((a -> a), a) -> a)",
+            "main": "(Int -> Int)",
+            "even": "(Int -> Bool)",
+            "odd": "(Int -> Bool)",
+        })
+        self.assertEqual(set(errors), {"bad", "usesbad"})
+        self.assertEqual(errors["usesbad"], "depends on ill-typed declaration bad")
+
+    def test_serial(self):
+        self.check(*module.infer_module_source(SOURCE, max_workers=1))
+
+    def test_process_pool(self):
+        self.check(*module.infer_module_source(SOURCE, max_workers=2, chunksize=1))
+
+    def test_duplicate(self):
+        with self.assertRaises(module.typing.TypingError):
+            module.infer_module_source("f = 1 f = 2", max_workers=1)
+
+
+class TestBatch(unittest.TestCase):
+    SOURCES = ["f x = x + 1", "g x y = if x then y else y", "h = 1 + true",
+               "k f = f(f(2))", "compose f g x = f(g(x))"]
+
+    def test_executors_agree(self):
+        p = module.parser.Parser()
+        decls = [p.parse_decl(src) for src in self.SOURCES * 20]
+        threads = module.infer_batch(decls, max_workers=8)
+        processes = module.infer_batch(decls, sources=self.SOURCES * 20,
+                                       executor="process", max_workers=2, chunksize=7)
+        self.assertEqual([(str(t), e) for t, e in threads],
+                         [(str(t), e) for t, e in processes])
+        self.assertEqual([str(t) for t, e in threads[:5]],
+                         ["(Int -> Int)", "((Bool, a) -> a)", "None",
+                          "((Int -> Int) -> Int)", "(((b -> a), (c -> b), c) -> a)"])
+        self.assertIn("cannot unify", threads[2][1])
+
+    def test_env(self):
+        p = module.parser.Parser()
+        typing = module.typing
+        env = {"id": typing.FuncType([typing.TypeVar(0)], typing.TypeVar(0))}
+        results = module.infer_batch([p.parse_decl("use = if id(true) then id(1) else 2"),
+                                      p.parse_decl("bad = id(1) + id(true)")], env)
+        self.assertEqual(str(results[0][0]), "Int")
+        self.assertIsNotNone(results[1][1])
+
+
+class TestLetPolymorphism(unittest.TestCase):
+    def test_decl_used_at_two_types(self):
+        types, errors = module.infer_module_source("""
+            id x = x
+            use = if id(true) then id(1) else 2
+            both f = if f(true) then f(1) else 2
+        """, max_workers=1)
+        self.assertEqual(str(types["id"]), "(a -> a)")
+        self.assertEqual(str(types["use"]), "Int")
+        # Lambda-bound variables stay monomorphic.
+        self.assertIn("both", errors)
+
+    def test_generalize_respects_levels(self):
+        typing = module.typing
+        typing.reset_type_counter()
+        outer = typing.TypeVar(100)
+        typing.enter_level()
+        x = typing.TypeVar(50)
+        inner = typing.instantiate(typing.TypeScheme([x], typing.FuncType([x], outer)))
+        typing.leave_level()
+        scheme = typing.generalize(inner, {})
+        self.assertEqual(len(scheme.quantified), 1)
+        self.assertNotIn(outer, scheme.quantified)
+
+
+class TestIncremental(unittest.TestCase):
+    def test_reuse_after_edit(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cache")
+            c = cache.InferenceCache(path)
+            module.infer_module_source(SOURCE, max_workers=1, cache=c)
+            self.assertEqual(c.reused, [])
+            c.save()
+
+            # Same signature for inc: only inc itself is recomputed.
+            c = cache.InferenceCache(path)
+            edited = SOURCE.replace("x + 1", "(x + 2)")
+            types, errors = module.infer_module_source(edited, max_workers=1, cache=c)
+            self.assertEqual(c.recomputed, ["inc"])
+            self.assertEqual(sorted(c.reused), ["bad", "even", "main", "odd", "twice"])
+
+            # Changed signature for inc: main depends on it and is redone.
+            edited = SOURCE.replace("inc x = x + 1", "inc x = x")
+            types, errors = module.infer_module_source(edited, max_workers=2, cache=c)
+            self.assertEqual(sorted(c.recomputed), ["inc", "main"])
+            self.assertEqual(str(types["main"]), "(a -> a)")
+
+    def test_layout_does_not_matter(self):
+        p = module.parser.Parser()
+        self.assertEqual(cache.decl_hash(p.parse_decl("f x = (x +   1)")),
+                         cache.decl_hash(p.parse_decl("f x =\n  x + 1")))
+        self.assertNotEqual(cache.decl_hash(p.parse_decl("f x = x + 1")),
+                            cache.decl_hash(p.parse_decl("f y = y + 1")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+
+import ast
+import cache
+import parser
+
+
+class TestPrecedence(unittest.TestCase):
+    def assert_shape(self, text, expected):
+        decl = parser.Parser().parse_decl(f"f = {text}")
+        self.assertEqual(str(decl.expr), expected)
+
+    def test_precedence(self):
+        self.assert_shape("a + b * c - d", "((a + (b * c)) - d)")
+        self.assert_shape("a * b + c % d", "((a * b) + (c % d))")
+        self.assert_shape("a + 1 < b * 2", "((a + 1) < (b * 2))")
+
+    def test_left_associative(self):
+        self.assert_shape("a - b - c", "((a - b) - c)")
+        self.assert_shape("a % b * c", "((a % b) * c)")
+
+    def test_parens_and_apps(self):
+        self.assert_shape("(a + b) * g(c - d, e)", "((a + b) * App(g, (c - d), e))")
+
+    def test_empty_arguments(self):
+        with self.assertRaises(parser.ParseError) as cm:
+            parser.Parser().parse_decl("f = g() + 1")
+        self.assertIn("non-empty argument list for g", str(cm.exception))
+
+    def test_long_chain(self):
+        n = 200000
+        decl = parser.Parser().parse_decl("f = x" + " + x * 2" * n)
+        node = decl.expr
+        depth = 0
+        while isinstance(node, ast.OpExpr):
+            self.assertEqual(node.op, "+")
+            node = node.left
+            depth += 1
+        self.assertEqual(depth, n)
+
+
+class TestParseFile(unittest.TestCase):
+    def test_matches_parse_module(self):
+        text = "".join(f"f{i} x = if x < {i} then g(x, {i}) else x * 2\n" for i in range(200))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "module")
+            with open(path, "w") as f:
+                f.write(text)
+            spans, file_spans = [], []
+            decls = parser.Parser().parse_module(text, spans)
+            file_decls = parser.Parser().parse_file(path, file_spans, chunk_size=16)
+        self.assertEqual([cache.decl_hash(d) for d in file_decls],
+                         [cache.decl_hash(d) for d in decls])
+        self.assertEqual(file_spans, spans)
+        self.assertEqual(spans[-1][1], len(text))
+
+    def test_error_location(self):
+        with self.assertRaises(parser.ParseError) as cm:
+            parser.Parser().parse_module("f x = x\ng y = y ? 1")
+        self.assertIn("2:9", str(cm.exception))
+
+
+if __name__ == "__main__":
+    unittest.main()
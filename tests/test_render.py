@@ -0,0 +1,76 @@
+import time
+import unittest
+
+import ast
+import parser
+import render
+import typing
+
+
+class TestRender(unittest.TestCase):
+    def test_nodes(self):
+        decl = parser.Parser().parse_decl(
+            "f g x = if g(x, lambda y -> y + 1) then x else 2 * 3")
+        self.assertEqual(str(decl), "Decl(f, Lambda([g, x], If(App(g, x, "
+                                    "Lambda([y], (y + 1))) then x else (2 * 3))))")
+
+    def test_types(self):
+        a, b = typing.TypeVar(0, "a"), typing.TypeVar(1, "b")
+        typ = typing.FuncType([typing.FuncType([a], b), typing.IntType()], typing.BoolType())
+        self.assertEqual(str(typ), "(((a -> b), Int) -> Bool)")
+        self.assertEqual(render.to_string(typ, max_depth=1), "(((... -> ...), Int) -> Bool)")
+
+    def test_truncation(self):
+        expr = parser.Parser().parse_decl("f x = g(x + 1, x * 2, h(x))").expr
+        self.assertEqual(render.to_string(expr, max_depth=2),
+                         "Lambda([x], App(g, (... + ...), (... * ...), App(..., ...)))")
+        self.assertEqual(render.to_string(expr, max_width=20), "Lambda([x], App(g...")
+        self.assertEqual(len(render.to_string(expr, max_width=20)), 20)
+        self.assertEqual(render.to_string(expr, max_width=1000), str(expr))
+
+    def test_deep_tree(self):
+        n = 100000
+        node = ast.Identifier("x")
+        for _ in range(n):
+            node = ast.OpExpr("+", node, ast.IntConstant(1))
+        self.assertEqual(len(str(node)), 1 + 6 * n)
+        self.assertEqual(render.to_string(node, max_width=10), "(((((((...")
+        short = ast.OpExpr("+", ast.OpExpr("+", ast.Identifier("x"), ast.IntConstant(1)),
+                           ast.IntConstant(2))
+        self.assertEqual(render.to_string(short, max_width=13), "((x + 1) + 2)")
+
+    def test_show_type_assignment_linear(self):
+        def dump(n):
+            text = "f = " + "lambda x -> " * n + "x"
+            expr = parser.Parser().parse_decl(text).expr
+            annotations = typing.assign_typenames(expr)
+            start = time.perf_counter()
+            lines = typing.show_type_assignment(expr, annotations).split("\n")
+            return time.perf_counter() - start, lines
+        small, _ = dump(2000)
+        large, lines = dump(8000)
+        self.assertEqual(len(lines), 8001)
+        self.assertTrue(all(len(line) <= 60 + 1 + 80 for line in lines))
+        self.assertLess(large, small * 16)
+
+    def test_operator_chain_linear(self):
+        def dump(n):
+            expr = parser.Parser().parse_decl("f x = x" + " + 1" * n).expr
+            annotations = typing.assign_typenames(expr)
+            equations = []
+            typing.generate_equations(expr, annotations, equations)
+            start = time.perf_counter()
+            lines = typing.show_type_assignment(expr, annotations).split("\n")
+            text = str(equations)
+            return time.perf_counter() - start, lines, text
+        small, _, _ = dump(1000)
+        large, lines, text = dump(8000)
+        self.assertEqual(len(lines), 2 * 8000 + 2)
+        self.assertTrue(lines[1].startswith("(" * 57 + "..."))
+        self.assertTrue(lines[7999].startswith("((x + 1) + 1) "))
+        self.assertIn("[from ((x + 1) + 1)]", text)
+        self.assertLess(large, small * 24)
+
+
+if __name__ == "__main__":
+    unittest.main()
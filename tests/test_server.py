@@ -0,0 +1,124 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+import server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(requests, srv=None, answers=None, limit=server.LINE_LIMIT):
+    srv = srv or server.InferenceServer()
+    if answers is None:
+        answers = []
+
+    async def main():
+        reader = asyncio.StreamReader(limit=limit)
+        for request in requests:
+            reader.feed_data((json.dumps(request) + "\n").encode())
+        reader.feed_eof()
+        await srv.serve(reader, answers.append)
+
+    asyncio.run(main())
+    return {answer["id"]: answer for answer in answers}
+
+
+class TestServer(unittest.TestCase):
+    def test_pipelined(self):
+        answers = run([
+            {"id": 1, "method": "infer", "source": "f x = x + 1"},
+            {"id": 2, "method": "infer", "source": "g = if 1 then 2 else 3"},
+            {"id": 3, "method": "module", "source": "id x = x\nuse = id(1)"},
+            {"id": 4, "method": "nope"},
+        ])
+        self.assertEqual(answers[1], {"id": 1, "name": "f", "type": "(Int -> Int)"})
+        self.assertIn("cannot unify", answers[2]["error"])
+        self.assertEqual(answers[3]["types"], {"id": "(a -> a)", "use": "Int"})
+        self.assertIn("bad request", answers[4]["error"])
+
+    def test_malformed(self):
+        answers = []
+        run([
+            [1],
+            {"id": [2], "method": "infer", "source": "f = 1"},
+            {"id": 3, "method": "module", "source": 5},
+            {"id": 4, "method": "infer", "source": "f = 1"},
+            {"id": 4, "method": "infer", "source": "g = 2"},
+            {"id": 5, "method": "cancel", "target": {}},
+            {"id": 6, "method": "infer", "source": "h = true"},
+        ], answers=answers)
+        errors = [a for a in answers if "error" in a]
+        self.assertEqual([a["id"] for a in errors], [None, None, 4, 5, 3])
+        self.assertTrue(all("bad request" in a["error"] for a in errors))
+        self.assertIn({"id": 4, "name": "f", "type": "Int"}, answers)
+        self.assertIn({"id": 6, "name": "h", "type": "Bool"}, answers)
+
+    def test_line_too_long(self):
+        long = "f x = x" + " + x" * 100
+        answers = []
+        run([
+            {"id": 1, "method": "infer", "source": long},
+            {"id": 2, "method": "infer", "source": "g = 2"},
+            {"id": 3, "method": "infer", "source": long + " + 1"},
+        ], answers=answers, limit=128)
+        self.assertCountEqual(answers, [
+            {"id": None, "error": "bad request: line too long"},
+            {"id": None, "error": "bad request: line too long"},
+            {"id": 2, "name": "g", "type": "Int"},
+        ])
+
+    def test_internal_error(self):
+        srv = server.InferenceServer()
+
+        def fail(source):
+            raise AssertionError("boom")
+
+        srv.infer = fail
+        answers = run([{"id": 1, "method": "infer", "source": "f = 1"},
+                       {"id": 2, "method": "module", "source": "f = 1"}], srv)
+        self.assertEqual(answers[1]["error"], "internal error: AssertionError: boom")
+        self.assertEqual(answers[2]["types"], {"f": "Int"})
+        srv.close()
+
+    def test_cached(self):
+        srv = server.InferenceServer()
+        run([{"id": 1, "method": "infer", "source": "f x = x + 1"}], srv)
+        answers = run([{"id": 1, "method": "infer", "source": "f x = x + 1"},
+                       {"id": 2, "method": "stats"}], srv)
+        self.assertEqual(answers[1]["type"], "(Int -> Int)")
+        self.assertEqual(answers[2]["infer"], [1, 1, 1])
+        self.assertEqual(answers[2]["parse"], [0, 1, 1])
+
+    def test_cancel(self):
+        # The worker is busy with the first request, so the second is still
+        # queued when its cancellation arrives.
+        slow = "f x = x" + " + x" * 100000
+        answers = run([
+            {"id": 1, "method": "infer", "source": slow},
+            {"id": 2, "method": "infer", "source": "g = 2"},
+            {"id": 3, "method": "cancel", "target": 2},
+            {"id": 4, "method": "cancel", "target": 9},
+        ])
+        self.assertEqual(answers[1]["type"], "(Int -> Int)")
+        self.assertEqual(answers[2], {"id": 2, "cancelled": True})
+        self.assertEqual(answers[3], {"id": 3, "cancelled": 2, "found": True})
+        self.assertEqual(answers[4], {"id": 4, "cancelled": 9, "found": False})
+
+    def test_command(self):
+        requests = [{"id": 1, "method": "infer", "source": "f x = x + 1"},
+                    {"id": 2, "method": "module", "source": "id x = x"}]
+        proc = subprocess.run(
+            [sys.executable, "-m", "type_inference", "serve"],
+            input="".join(json.dumps(r) + "\n" for r in requests),
+            cwd=ROOT, capture_output=True, text=True, timeout=60)
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        answers = {a["id"]: a for a in map(json.loads, proc.stdout.splitlines())}
+        self.assertEqual(answers[1]["type"], "(Int -> Int)")
+        self.assertEqual(answers[2]["types"], {"id": "(a -> a)"})
+
+
+if __name__ == "__main__":
+    unittest.main()
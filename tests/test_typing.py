@@ -0,0 +1,516 @@
+import concurrent.futures
+import unittest
+
+import ast
+import environment
+import hashcons
+import module
+import parser
+from typing import *
+
+
+def build_sub():
+    # foo f x = f(3) - f(x)
+    return ast.LambdaExpr(
+        ["f", "x"],
+        ast.OpExpr("-",
+                   ast.AppExpr(ast.Identifier("f"), [ast.IntConstant(3)]),
+                   ast.AppExpr(ast.Identifier("f"), [ast.Identifier("x")])))
+
+
+def infer(expr, solver):
+    reset_type_counter()
+    annotations = assign_typenames(expr)
+    equations = []
+    generate_equations(expr, annotations, equations)
+    unifier = unify_all_equations(equations, solver=solver)
+    return get_expression_type(expr, annotations, unifier, rename_types=True)
+
+
+class TestSolvers(unittest.TestCase):
+    def test_solvers_agree(self):
+        for solver in SOLVERS:
+            self.assertEqual(str(infer(build_sub(), solver)),
+                             "(((Int -> Int), Int) -> Int)")
+
+    def test_unionfind_mismatch(self):
+        expr = ast.IfExpr(ast.IntConstant(1), ast.IntConstant(2),
+                          ast.IntConstant(3))
+        annotations = assign_typenames(expr)
+        equations = []
+        generate_equations(expr, annotations, equations)
+        self.assertIsNone(unify_all_equations(equations))
+        self.assertIsNone(unify_all_equations(equations, solver="dict"))
+
+    def test_unionfind_chain(self):
+        subst = UnionFindSubst()
+        names = [TypeVar(i) for i in range(1000)]
+        for a, b in zip(names, names[1:]):
+            self.assertTrue(subst.unify(a, b))
+        self.assertTrue(subst.unify(names[0], IntType()))
+        self.assertEqual(apply_unifier(names[-1], subst), IntType())
+
+
+class TestDeferredOccursCheck(unittest.TestCase):
+    def test_self_application(self):
+        # lambda x -> x(x) has no finite type.
+        expr = ast.LambdaExpr(["x"], ast.AppExpr(ast.Identifier("x"), [ast.Identifier("x")]))
+        annotations = assign_typenames(expr)
+        for solver in SOLVERS:
+            subst, conflict = unify_stream(iter_equations(expr, annotations), solver)
+            self.assertIs(conflict.orig_node, expr.expr)
+
+    def test_cyclic_classes_merge(self):
+        x, y, a, b = TypeVar(1), TypeVar(2), TypeVar(3), TypeVar(4)
+        eqs = [TypeEquation(x, FuncType([x], a), "first"),
+               TypeEquation(y, FuncType([y], b), "second"),
+               TypeEquation(x, y, "third")]
+        self.assertEqual(unify_stream(eqs)[1].orig_node, "first")
+        self.assertEqual(unify_stream(eqs, "deferred")[1].orig_node, "third")
+
+    def test_cycle_without_equations(self):
+        x, a = TypeVar(1), TypeVar(2)
+        subst = UnionFindSubst(deferred=True)
+        self.assertTrue(subst.unify(x, a))
+        self.assertTrue(subst.unify(a, FuncType([x], IntType())))
+        conflict = subst.find_cycle()
+        self.assertIs(conflict.left, a)
+        self.assertIsNone(conflict.orig_node)
+
+    def test_deep_lambda_chain(self):
+        n = 20000
+        expr = ast.Identifier("a0")
+        for i in reversed(range(n)):
+            expr = ast.LambdaExpr([f"a{i}"], expr)
+        reset_type_counter()
+        annotations = assign_typenames(expr)
+        ctx = InferenceContext(Stats())
+        subst, conflict = unify_stream(iter_equations(expr, annotations), "deferred", ctx)
+        self.assertIsNone(conflict)
+        self.assertLess(ctx.stats["unify_steps"], 3 * n)
+        typ = t = get_expression_type(expr, annotations, subst)
+        for _ in range(n):
+            t = t.rettype
+        self.assertIs(t, typ.argtypes[0])
+
+    def test_levels_lowered(self):
+        types, errors = module.infer_module_source("""
+            id x = x
+            pair f = lambda g -> g(f)
+            use = if id(true) then id(1) else 2
+        """, max_workers=1)
+        self.assertEqual(str(types["pair"]), "(b -> ((b -> a) -> a))")
+        self.assertEqual(str(types["use"]), "Int")
+
+
+class TestResolvedTypes(unittest.TestCase):
+    def test_type_of(self):
+        expr = build_sub()
+        reset_type_counter()
+        annotations = assign_typenames(expr)
+        subst = unify_all_equations(iter_equations(expr, annotations))
+        resolved = resolve_all(expr, annotations, subst)
+        self.assertEqual(len(resolved.types), len(annotations))
+        self.assertEqual(str(resolved.type_of(expr.expr)), "Int")
+        self.assertIs(resolved[expr], apply_unifier(annotations[expr], subst))
+        self.assertEqual(str(resolved.arg_types_of(expr)["f"]), "(Int -> Int)")
+        self.assertIn("App(f, 3)" + " " * 52 + "Int", show_type_assignment(expr, resolved))
+
+    def test_shared_terms_resolved_once(self):
+        # A chain of n variables is followed once, not once per node.
+        n = 5000
+        vs = [TypeVar(i) for i in range(n)]
+        subst = dict(zip(vs, vs[1:]))
+        subst[vs[-1]] = BoolType()
+        annotations = Annotations()
+        nodes = [ast.Identifier(f"x{i}") for i in range(n)]
+        for node, v in zip(nodes, vs):
+            annotations.types[node] = v
+        resolved = ResolvedTypes(annotations, subst)
+        self.assertTrue(all(resolved.type_of(node) is BoolType() for node in nodes))
+
+
+class TestStreaming(unittest.TestCase):
+    def test_stops_at_first_conflict(self):
+        # if 1 then true else (2 + 3): the condition conflicts first.
+        expr = ast.IfExpr(ast.IntConstant(1), ast.BoolConstant("true"),
+                          ast.OpExpr("+", ast.IntConstant(2), ast.IntConstant(3)))
+        annotations = assign_typenames(expr)
+        pulled = []
+        def equations():
+            for eq in iter_equations(expr, annotations):
+                pulled.append(eq)
+                yield eq
+        for solver in SOLVERS:
+            del pulled[:]
+            subst, conflict = unify_stream(equations(), solver=solver)
+            self.assertIs(conflict.orig_node, expr)
+            self.assertIs(pulled[-1], conflict)
+
+    def test_matches_list_mode(self):
+        expr = build_sub()
+        reset_type_counter()
+        annotations = assign_typenames(expr)
+        equations = []
+        generate_equations(expr, annotations, equations)
+        subst, conflict = unify_stream(iter_equations(expr, annotations))
+        self.assertIsNone(conflict)
+        self.assertEqual(str(get_expression_type(expr, annotations, subst, rename_types=True)),
+                         str(get_expression_type(expr, annotations, unify_all_equations(equations),
+                                                 rename_types=True)))
+
+
+class TestSimplify(unittest.TestCase):
+    PROGRAMS = [
+        "f g x = if g(x) then x + 1 else 2 * 3",
+        "twice f x = f(f(x))",
+        "k a b c = if a then b else if true then c else b",
+        "s f g x = f(x, g(x))",
+    ]
+
+    def test_same_types(self):
+        for text in self.PROGRAMS:
+            for solver in SOLVERS:
+                decl = parser.Parser().parse_decl(text)
+                self.assertEqual(infer_decls([decl], solver=solver, simplify=True),
+                                 infer_decls([decl], solver=solver))
+
+    def test_removes_redundant_equations(self):
+        a, b, c, d = TypeVar(1), TypeVar(2), TypeVar(3), TypeVar(4)
+        eqs = [TypeEquation(IntType(), IntType(), "tautology"),
+               TypeEquation(a, b, "alias"),
+               TypeEquation(b, c, "alias"),
+               TypeEquation(c, a, "redundant alias"),
+               TypeEquation(d, FuncType([a], b), "func"),
+               TypeEquation(c, IntType(), "ground"),
+               TypeEquation(IntType(), b, "duplicate ground")]
+        stats = Stats()
+        simplified = simplify_equations(eqs, stats)
+        self.assertEqual(stats["equations_removed"], 3)
+        self.assertEqual([eq.orig_node for eq in simplified],
+                         ["ground", "func", "alias", "alias"])
+        self.assertIs(simplified[1].right, FuncType([c], c))
+        subst = unify_all_equations(simplified)
+        self.assertEqual(str(apply_unifier(d, subst)), "(Int -> Int)")
+        self.assertIs(apply_unifier(a, subst), IntType())
+
+    def test_conflicts_kept(self):
+        for text in ("bad = if 1 then 2 else 3", "loop x = x(x)"):
+            decl = parser.Parser().parse_decl(text)
+            for solver in SOLVERS:
+                with self.assertRaises(TypingError):
+                    infer_decls([decl], solver=solver, simplify=True)
+
+
+class TestSignatureCache(unittest.TestCase):
+    def test_alpha_equivalence(self):
+        x = FuncType([FuncType([TypeVar(7)], TypeVar(3))], IntType())
+        y = FuncType([FuncType([TypeVar(40)], TypeVar(12))], IntType())
+        z = FuncType([FuncType([TypeVar(7)], TypeVar(7))], IntType())
+        self.assertIs(canonical_type(x), canonical_type(y))
+        self.assertEqual(str(canonical_type(x)), "((b -> a) -> Int)")
+        self.assertTrue(alpha_equivalent(x, y))
+        self.assertFalse(alpha_equivalent(x, z))
+        self.assertEqual(type_hash(x), type_hash(y))
+        self.assertNotEqual(type_hash(x), type_hash(z))
+
+    def test_stable_hash(self):
+        # Fixed across processes and runs, unlike hash().
+        x = FuncType([FuncType([TypeVar(7)], TypeVar(3))], IntType())
+        self.assertEqual(type_hash(x), "6e1eca16c56282a01a41c5265938f4f4")
+
+    def test_signatures_shared(self):
+        cache = SignatureCache()
+        sigs = [cache.canonical(FuncType([TypeVar(i), TypeVar(i + 1)], TypeVar(i)))
+                for i in range(100)]
+        self.assertEqual(len(cache), 1)
+        self.assertEqual((cache.hits, cache.misses), (99, 1))
+        self.assertTrue(all(sig is sigs[0] for sig in sigs))
+        decls = parser.Parser().parse_module(
+            "".join(f"h{i} f x = f(x, {i})\n" for i in range(50)))
+        types, errors = module.infer_module(decls, max_workers=1)
+        self.assertEqual(len({id(typ) for typ in types.values()}), 1)
+
+    def test_entries_released(self):
+        import gc
+        cache = SignatureCache()
+        sigs = [cache.canonical(FuncType([TypeVar(10**6 + i)], FuncType([IntType()] * (i + 1),
+                                                                       TypeVar(10**6 + i))))
+                for i in range(100)]
+        self.assertIs(cache.canonical(sigs[0]), sigs[0])
+        self.assertEqual(len(cache), 100)
+        del sigs
+        gc.collect()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(len(cache.canon), 0)
+
+
+class TestSubtreeMemo(unittest.TestCase):
+    def parse(self, text, table):
+        return parser.Parser(share=table).parse_module(text)
+
+    def test_closed_subtrees_shared(self):
+        table = hashcons.SubtreeTable()
+        a, b, c, d = self.parse("a x = g(x, lambda y -> y + 1)\nb = lambda y -> y + 1\n"
+                                "c y = g(y + 1)\nd y = g(y + 1)", table)
+        self.assertIs(a.expr.expr.args[1], b.expr)
+        self.assertNotIn(a.expr.expr, table.closed)
+        self.assertIsNot(c.expr, d.expr)
+        self.assertIsNot(c.expr.expr.args[0], d.expr.expr.args[0])
+
+    def test_same_types(self):
+        text = "".join(f"h{i} f g = f(lambda y -> y, (1 + 2) * 3) + g(lambda y -> y, true)\n"
+                       for i in range(20))
+        table = hashcons.SubtreeTable()
+        shared = self.parse(text, table)
+        plain = parser.Parser().parse_module(text)
+        for s, p in zip(shared, plain):
+            self.assertEqual(infer_decls([s], subtrees=table), infer_decls([p]))
+        self.assertEqual(str(infer_decls([shared[0]], subtrees=table)["h0"]),
+                         "(((((a -> a), Int) -> Int), (((b -> b), Bool) -> Int)) -> Int)")
+        # Inferred once each: the lambda, (1 + 2) * 3 and, inside it, 1 + 2.
+        self.assertEqual(table.misses, 3)
+        self.assertEqual(table.hits, 3 * 21 + 1 - 3)
+
+    def test_released(self):
+        import gc
+        table = hashcons.SubtreeTable(max_structures=100)
+        decls = self.parse("".join(f"h{i} f = f(lambda y -> y + {i})\n" for i in range(50)), table)
+        for decl in decls:
+            infer_decls([decl], subtrees=table)
+        self.assertEqual(len(table.types), 50)
+        del decls, decl
+        gc.collect()
+        self.assertEqual((len(table.shared), len(table.closed), len(table.types)), (0, 0, 0))
+        for i in range(20):
+            self.parse("".join(f"g x = x + {i * 100 + j}\n" for j in range(100)), table)
+        self.assertLess(len(table.ids), 500)
+        a, b = self.parse("a = lambda y -> y + 1\nb = lambda y -> y + 1", table)
+        self.assertIs(a.expr, b.expr)
+
+    def test_shared_tree_needs_table(self):
+        table = hashcons.SubtreeTable()
+        text = "h f g = f(lambda y -> y) + g(lambda y -> y)\nuse = h(lambda k -> k(1), lambda k -> 2)"
+        decls = self.parse(text, table)
+        with self.assertRaises(TypingError) as cm:
+            infer_decls(decls[:1])
+        self.assertIn("is shared", str(cm.exception))
+        types, errors = module.infer_module(decls, subtrees=table)
+        self.assertEqual(errors, {})
+        self.assertEqual(str(types["h"]), "((((a -> a) -> Int), ((b -> b) -> Int)) -> Int)")
+        self.assertEqual(str(types["use"]), "Int")
+
+    def test_error_in_shared_subtree(self):
+        table = hashcons.SubtreeTable()
+        decl, = self.parse("bad x = x + (if 1 then 2 else 3)", table)
+        with self.assertRaises(TypingError):
+            infer_decls([decl], subtrees=table)
+
+
+class TestEnvironment(unittest.TestCase):
+    def test_scopes(self):
+        builtins = {"x": IntType(), "y": BoolType()}
+        env = environment.Environment(builtins)
+        env.push_scope({"x": BoolType()})
+        env.push_scope({"x": TypeVar(1), "z": TypeVar(2)})
+        self.assertIs(env["x"], TypeVar(1))
+        self.assertIs(env["y"], BoolType())
+        env.pop_scope()
+        self.assertIs(env["x"], BoolType())
+        self.assertNotIn("z", env)
+        env.pop_scope()
+        self.assertIs(env["x"], IntType())
+        self.assertIs(env.globals, builtins)
+
+    def test_assign_typenames_leaves_globals_alone(self):
+        builtins = {"one": IntType()}
+        expr = ast.LambdaExpr(["one"], ast.OpExpr("+", ast.Identifier("one"),
+                                                  ast.Identifier("one")))
+        annotations = assign_typenames(expr, builtins)
+        self.assertEqual(builtins, {"one": IntType()})
+        self.assertIs(annotations[expr.expr.left], annotations.arg_types[expr]["one"])
+
+    def test_unwinds_after_error(self):
+        env = environment.Environment()
+        expr = ast.LambdaExpr(["x"], ast.Identifier("nope"))
+        with self.assertRaises(TypingError):
+            assign_typenames(expr, env)
+        self.assertEqual(env.scopes, [])
+        self.assertEqual(env.locals, {})
+
+
+class TestAnnotations(unittest.TestCase):
+    def test_ast_untouched(self):
+        decl = parser.Parser().parse_decl("pick b f = if b then f(1) else f(2) + 1")
+        before = [dict(vars(node)) for node in ast_nodes(decl)]
+        first = infer_decls([decl])
+        self.assertEqual([vars(node) for node in ast_nodes(decl)], before)
+        self.assertEqual(str(infer_decls([decl])["pick"]), str(first["pick"]))
+
+    def test_separate_runs(self):
+        expr = build_sub()
+        reset_type_counter()
+        one = assign_typenames(expr)
+        two = assign_typenames(expr)
+        self.assertEqual(len(one), len(two))
+        self.assertIsNot(one[expr], two[expr])
+
+
+class TestInferenceContext(unittest.TestCase):
+    def test_isolated(self):
+        expr = build_sub()
+        one, two = InferenceContext(Stats()), InferenceContext(Stats())
+        first = assign_typenames(expr, ctx=one)
+        reset_type_counter()
+        second = assign_typenames(expr, ctx=two)
+        self.assertIs(first[expr], second[expr])
+        self.assertEqual(one.next_id, two.next_id)
+        subst, conflict = unify_stream(iter_equations(expr, first), ctx=one)
+        self.assertIs(one.subst, subst)
+        self.assertEqual(one.stats["typevars"], one.next_id)
+        self.assertEqual(two.stats["equations"], 0)
+
+    def test_level_restored_on_error(self):
+        ctx = InferenceContext()
+        for text in ("f = nope", "f = if 1 then 2 else 3"):
+            with self.assertRaises(TypingError):
+                infer_decls([parser.Parser().parse_decl(text)], ctx=ctx)
+            self.assertEqual(ctx.level, 0)
+
+    def test_threads(self):
+        decl = parser.Parser().parse_decl("twice f x = f(f(x + 1))")
+        with concurrent.futures.ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(lambda _: str(infer_decls([decl])["twice"]), range(64)))
+        self.assertEqual(set(results), {"(((Int -> Int), Int) -> Int)"})
+
+
+class TestStats(unittest.TestCase):
+    def test_counters_and_hooks(self):
+        spans = []
+        stats = Stats(hooks=[lambda name, start, end: spans.append((name, end >= start))])
+        ctx = InferenceContext(stats)
+        decl = parser.Parser().parse_decl("f g x = if x < 2 then g(x) else g(x - 1)")
+        infer_decls([decl], ctx=ctx, solver="unionfind")
+        self.assertEqual(spans, [("assign", True), ("solve", True)])
+        self.assertEqual(set(stats.timers), {"assign", "solve"})
+        self.assertEqual(stats["equations"], stats["unify_calls"])
+        self.assertGreater(stats["occurs_steps"], 0)
+        self.assertEqual(stats["typevars"], ctx.next_id)
+        stats.count_nodes(decl)
+        self.assertEqual(stats["nodes.AppExpr"], 2)
+        self.assertIn("unify_steps", stats.report())
+
+    def test_dict_solver(self):
+        ctx = InferenceContext(Stats())
+        self.assertIsNone(unify_variable(TypeVar(1), FuncType([TypeVar(1)], IntType()), {}, ctx))
+        self.assertEqual(ctx.stats["unify_variable_calls"], 1)
+        self.assertEqual(ctx.stats["occurs_steps"], 3)
+
+    def test_variable_calls(self):
+        decl = parser.Parser().parse_decl("f g x = if x < 2 then g(x) else g(x - 1)")
+        for solver in SOLVERS:
+            ctx = InferenceContext(Stats())
+            infer_decls([decl], ctx=ctx, solver=solver)
+            self.assertGreater(ctx.stats["unify_variable_calls"], 0)
+
+    def test_disabled(self):
+        ctx = InferenceContext()
+        self.assertIsInstance(ctx.stats, NullStats)
+        infer_decls([parser.Parser().parse_decl("f x = x + 1")], ctx=ctx)
+        self.assertEqual(ctx.stats.counters, {})
+        self.assertEqual(ctx.stats.timers, {})
+
+
+def ast_nodes(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(node._children)
+
+
+class TestTypeTerms(unittest.TestCase):
+    def test_interned(self):
+        self.assertIs(IntType(), IntType())
+        self.assertIs(BoolType(), BoolType())
+        self.assertIs(TypeVar(3), TypeVar(3))
+        self.assertIsNot(TypeVar(3), TypeVar(4))
+        f = FuncType([TypeVar(1), IntType()], BoolType())
+        self.assertIs(f, FuncType((TypeVar(1), IntType()), BoolType()))
+        self.assertEqual(hash(f), hash(FuncType([TypeVar(1), IntType()], BoolType())))
+        self.assertEqual(str(f), "((t1, Int) -> Bool)")
+
+    def test_immutable(self):
+        with self.assertRaises(AttributeError):
+            TypeVar(1).name = "a"
+        with self.assertRaises(AttributeError):
+            FuncType([IntType()], IntType()).rettype = BoolType()
+
+    def test_rename_does_not_mutate(self):
+        expr = ast.LambdaExpr(["x"], ast.Identifier("x"))
+        reset_type_counter()
+        annotations = assign_typenames(expr)
+        equations = []
+        generate_equations(expr, annotations, equations)
+        unifier = unify_all_equations(equations)
+        self.assertEqual(str(get_expression_type(expr, annotations, unifier, rename_types=True)),
+                         "(a -> a)")
+        self.assertEqual(str(annotations.arg_types[expr]["x"]), "t1")
+
+    def test_pickle(self):
+        import pickle
+        f = FuncType([TypeVar(1), TypeVar(2, "b")], IntType())
+        self.assertIs(pickle.loads(pickle.dumps(f)), f)
+
+    def test_interning_across_threads(self):
+        import sys
+        import threading
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for trial in range(50):
+                base = 10**9 + trial * 100
+                barrier = threading.Barrier(8)
+                built = []
+
+                def build():
+                    barrier.wait()
+                    built.append([FuncType([TypeVar(base + i)], IntType()) for i in range(100)])
+
+                threads = [threading.Thread(target=build) for _ in range(8)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                for terms in built[1:]:
+                    for a, b in zip(built[0], terms):
+                        self.assertIs(a, b)
+        finally:
+            sys.setswitchinterval(interval)
+
+
+class TestDeepNesting(unittest.TestCase):
+    depth = 20000
+
+    def infer_decl(self, text):
+        decl = parser.Parser().parse_decl(text)
+        return infer(decl.expr, "unionfind")
+
+    def test_deep_parens(self):
+        n = self.depth
+        self.assertEqual(str(self.infer_decl("f x = " + "(" * n + "x + 1" + ")" * n)),
+                         "(Int -> Int)")
+
+    def test_deep_if(self):
+        n = self.depth
+        text = "f x = " + "if x then " * n + "1" + " else 2" * n
+        self.assertEqual(str(self.infer_decl(text)), "(Bool -> Int)")
+
+    def test_deep_app(self):
+        n = self.depth
+        text = "f g = " + "g(" * n + "true" + ")" * n
+        self.assertEqual(str(self.infer_decl(text)), "((Bool -> Bool) -> Bool)")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1 +1,27 @@
+import os
+import sys
+
 __version__ = '0.1.0'
+
+
+# The modules of this package import each other by plain name, and their
+# ast and typing must win over the standard library's, as when a script in
+# this directory is run directly. Puts the directory first on sys.path and
+# forgets the standard ast and typing if they are loaded; modules that
+# already imported them keep their reference.
+def use_flat_modules():
+    directory = os.path.dirname(os.path.abspath(__file__))
+    if sys.path[0] != directory:
+        sys.path.insert(0, directory)
+    for name in ("ast", "typing"):
+        module = sys.modules.get(name)
+        if module is not None and os.path.dirname(getattr(module, "__file__", "")) != directory:
+            del sys.modules[name]
+
+
+# Pool initializer for worker processes that start afresh rather than fork:
+# they must switch to the flat modules before anything imports them.
+def init_worker(*args):
+    use_flat_modules()
+    import check
+    check._init_worker(*args)
@@ -0,0 +1,28 @@
+import argparse
+import asyncio
+import sys
+
+import type_inference
+
+type_inference.use_flat_modules()
+
+import check
+import server
+
+
+def main(argv):
+    argparser = argparse.ArgumentParser(prog="python -m type_inference")
+    commands = argparser.add_subparsers(dest="command", required=True)
+    check.add_arguments(commands.add_parser(
+        "check", help="infer every declaration in files or directories, "
+                      "printing JSON lines"))
+    server.add_arguments(commands.add_parser(
+        "serve", help="answer JSON-lines inference requests on stdin/stdout or a socket"))
+    args = argparser.parse_args(argv)
+    if args.command == "serve":
+        return server.main(args)
+    return check.main(args, type_inference.init_worker)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,74 +1,83 @@
+import render
+
+
+# Nodes render through render.to_string() from the strings and child nodes
+# their _parts() return, so printing a tree is linear in its size.
 class ASTNode:
     def visit_children(self, func):
         for child in self._children:
             func(child)
 
-    _type = None
     _children = []
 
+    def __str__(self):
+        return render.to_string(self)
+
 
 class IntConstant(ASTNode):
     def __init__(self, value):
         self.value = value
 
-    def __str__(self):
-        return str(self.value)
+    def _parts(self):
+        return (str(self.value),)
 
 
 class BoolConstant(ASTNode):
     def __init__(self, value):
         self.value = value
 
-    def __str__(self):
-        return str(self.value)
+    def _parts(self):
+        return (str(self.value),)
 
 
-class Identifier(self):
+class Identifier(ASTNode):
     def __init__(self, name):
         self.name = name
 
-    def __str__(self):
-        return self.name
+    def _parts(self):
+        return (self.name,)
 
 
-class OpExpr(self):
+class OpExpr(ASTNode):
     def __init__(self, op, left, right):
         self.op = op
         self.left = left
         self.right = right
+        self._children = [self.left, self.right]
 
-    def __str__(self):
-        return f"{self.left} {self.op} {self.right}"
+    def _parts(self):
+        return ("(", self.left, f" {self.op} ", self.right, ")")
 
 
-class AppExpr(self):
+class AppExpr(ASTNode):
     def __init__(self, func, args=None):
         self.func = func
         self.args = args
         self._children = [self.func, *self.args]
 
-    def __str__(self):
-        return f"App({self.func}, {', '.join(map(str, self.args))})"
+    def _parts(self):
+        return ("App(", self.func, ", ", *render.joined(self.args), ")")
 
 
-class IfExpr(self):
+class IfExpr(ASTNode):
     def __init__(self, ifexpr, thenexpr, elseexpr):
         self.ifexpr = ifexpr
         self.thenexpr = thenexpr
         self.elseexpr = elseexpr
+        self._children = [self.ifexpr, self.thenexpr, self.elseexpr]
 
-    def __str__(self):
-        return f"If({self.ifexpr} then {self.thenexpr} else {self.elseexpr})"
+    def _parts(self):
+        return ("If(", self.ifexpr, " then ", self.thenexpr, " else ", self.elseexpr, ")")
 
 
-class LambdaExpr(self):
+class LambdaExpr(ASTNode):
     def __init__(self, argnames, expr):
         self.argnames = argnames
         self.expr = expr
         self._children = [self.expr]
 
-    def __str__(self):
-        return f"[{', '.join(self.argnames), self.expr}]"
+    def _parts(self):
+        return (f"Lambda([{', '.join(self.argnames)}], ", self.expr, ")")
 
 
 class Decl(ASTNode):
@@ -77,5 +86,5 @@ class Decl(ASTNode):
         self.expr = expr
         self._children = [self.expr]
 
-    def __str__(self):
-        return "Decl({self.name}, {self.expr})"
+    def _parts(self):
+        return (f"Decl({self.name}, ", self.expr, ")")
@@ -0,0 +1,250 @@
+import array
+
+import ast
+
+
+# Node kinds, in the order of the kind codes stored in ASTStore.kinds.
+INT, BOOL, IDENT, OP, APP, IF, LAMBDA, DECL = range(8)
+KINDS = (ast.IntConstant, ast.BoolConstant, ast.Identifier, ast.OpExpr,
+         ast.AppExpr, ast.IfExpr, ast.LambdaExpr, ast.Decl)
+_KIND_CODES = {cls: code for code, cls in enumerate(KINDS)}
+
+
+# A whole program's AST as parallel typed arrays. A node is an integer id:
+#   kinds[id]     kind code (INT ... DECL)
+#   data[id]      string id of the literal, identifier name, operator or
+#                 declared name; for a lambda, the offset in `extra` of its
+#                 argument count followed by the argument name string ids
+#   first[id]     offset in `children` of the node's first child id
+#   count[id]     number of children
+# Strings are interned once in `strings`, and children are stored before
+# their parents. Nodes cost a few machine words instead of a Python object
+# each.
+#
+# The methods named after the ast classes take the same arguments, with ids
+# in place of child nodes, and return the new node's id; a parser can build
+# into a store by calling them instead of the classes. view() gives node
+# objects that pass for the ast classes, so the passes in typing.py run over
+# a store unchanged; to_node() materializes the ordinary classes.
+class ASTStore:
+    def __init__(self):
+        self.kinds = array.array("b")
+        self.data = array.array("i")
+        self.first = array.array("i")
+        self.count = array.array("i")
+        self.children = array.array("i")
+        self.extra = array.array("i")
+        self.strings = []
+        self.string_ids = {}
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def intern(self, s):
+        sid = self.string_ids.get(s)
+        if sid is None:
+            sid = self.string_ids[s] = len(self.strings)
+            self.strings.append(s)
+        return sid
+
+    def _add(self, kind, data, children=()):
+        id = len(self.kinds)
+        self.kinds.append(kind)
+        self.data.append(data)
+        self.first.append(len(self.children))
+        self.count.append(len(children))
+        self.children.extend(children)
+        return id
+
+    def IntConstant(self, value):
+        return self._add(INT, self.intern(value))
+
+    def BoolConstant(self, value):
+        return self._add(BOOL, self.intern(value))
+
+    def Identifier(self, name):
+        return self._add(IDENT, self.intern(name))
+
+    def OpExpr(self, op, left, right):
+        return self._add(OP, self.intern(op), (left, right))
+
+    def AppExpr(self, func, args=None):
+        return self._add(APP, -1, (func, *args))
+
+    def IfExpr(self, ifexpr, thenexpr, elseexpr):
+        return self._add(IF, -1, (ifexpr, thenexpr, elseexpr))
+
+    def LambdaExpr(self, argnames, expr):
+        offset = len(self.extra)
+        self.extra.append(len(argnames))
+        self.extra.extend(self.intern(name) for name in argnames)
+        return self._add(LAMBDA, offset, (expr,))
+
+    def Decl(self, name, expr):
+        return self._add(DECL, self.intern(name), (expr,))
+
+    def child_ids(self, id):
+        start = self.first[id]
+        return self.children[start:start + self.count[id]]
+
+    def string(self, id):
+        return self.strings[self.data[id]]
+
+    def argnames(self, id):
+        offset = self.data[id]
+        return [self.strings[s] for s in
+                self.extra[offset + 1:offset + 1 + self.extra[offset]]]
+
+    def view(self, id):
+        return _VIEWS[self.kinds[id]](self, id)
+
+    # Copies a tree of ast objects into the store and returns the root's id.
+    # A subtree object reached twice is stored once.
+    def add(self, node):
+        ids = {}
+        stack = [(node, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if id(node) in ids:
+                continue
+            if not expanded and node._children:
+                stack.append((node, True))
+                stack.extend((c, False) for c in reversed(node._children))
+                continue
+            kind = _KIND_CODES[type(node)]
+            kid = [ids[id(c)] for c in node._children]
+            if kind == INT or kind == BOOL:
+                nid = self._add(kind, self.intern(node.value))
+            elif kind == IDENT:
+                nid = self.Identifier(node.name)
+            elif kind == OP:
+                nid = self.OpExpr(node.op, *kid)
+            elif kind == APP:
+                nid = self.AppExpr(kid[0], kid[1:])
+            elif kind == IF:
+                nid = self.IfExpr(*kid)
+            elif kind == LAMBDA:
+                nid = self.LambdaExpr(node.argnames, kid[0])
+            else:
+                nid = self.Decl(node.name, kid[0])
+            ids[id(node)] = nid
+        return nid
+
+    # Builds ordinary ast objects for the tree rooted at `id`.
+    def to_node(self, nid):
+        nodes = {}
+        stack = [(nid, False)]
+        while stack:
+            nid, expanded = stack.pop()
+            if nid in nodes:
+                continue
+            if not expanded and self.count[nid]:
+                stack.append((nid, True))
+                stack.extend((c, False) for c in reversed(self.child_ids(nid)))
+                continue
+            kind = self.kinds[nid]
+            kids = [nodes[c] for c in self.child_ids(nid)]
+            if kind == INT or kind == BOOL or kind == IDENT:
+                node = KINDS[kind](self.string(nid))
+            elif kind == OP:
+                node = ast.OpExpr(self.string(nid), *kids)
+            elif kind == APP:
+                node = ast.AppExpr(kids[0], kids[1:])
+            elif kind == IF:
+                node = ast.IfExpr(*kids)
+            elif kind == LAMBDA:
+                node = ast.LambdaExpr(self.argnames(nid), kids[0])
+            else:
+                node = ast.Decl(self.string(nid), kids[0])
+            nodes[nid] = node
+        return node
+
+
+# A read-only node of an ASTStore seen through the interface of its ast
+# class. Views are created on access and compare equal when they name the
+# same node, so they can key typing.Annotations.
+class _View:
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return (isinstance(other, _View) and self.store is other.store
+                and self.id == other.id)
+
+    def __hash__(self):
+        return hash((id(self.store), self.id))
+
+    @property
+    def _children(self):
+        store = self.store
+        return [store.view(c) for c in store.child_ids(self.id)]
+
+    def _child(self, i):
+        return self.store.view(self.store.children[self.store.first[self.id] + i])
+
+
+class IntConstantView(_View, ast.IntConstant):
+    __slots__ = ("store", "id")
+
+    def __init__(self, store, id):
+        self.store = store
+        self.id = id
+
+    @property
+    def value(self):
+        return self.store.string(self.id)
+
+
+class BoolConstantView(_View, ast.BoolConstant):
+    __slots__ = ("store", "id")
+    __init__ = IntConstantView.__init__
+    value = IntConstantView.value
+
+
+class IdentifierView(_View, ast.Identifier):
+    __slots__ = ("store", "id")
+    __init__ = IntConstantView.__init__
+
+    @property
+    def name(self):
+        return self.store.string(self.id)
+
+
+class OpExprView(_View, ast.OpExpr):
+    __slots__ = ("store", "id")
+    __init__ = IntConstantView.__init__
+    op = IdentifierView.name
+    left = property(lambda self: self._child(0))
+    right = property(lambda self: self._child(1))
+
+
+class AppExprView(_View, ast.AppExpr):
+    __slots__ = ("store", "id")
+    __init__ = IntConstantView.__init__
+    func = property(lambda self: self._child(0))
+    args = property(lambda self: self._children[1:])
+
+
+class IfExprView(_View, ast.IfExpr):
+    __slots__ = ("store", "id")
+    __init__ = IntConstantView.__init__
+    ifexpr = property(lambda self: self._child(0))
+    thenexpr = property(lambda self: self._child(1))
+    elseexpr = property(lambda self: self._child(2))
+
+
+class LambdaExprView(_View, ast.LambdaExpr):
+    __slots__ = ("store", "id")
+    __init__ = IntConstantView.__init__
+    argnames = property(lambda self: self.store.argnames(self.id))
+    expr = property(lambda self: self._child(0))
+
+
+class DeclView(_View, ast.Decl):
+    __slots__ = ("store", "id")
+    __init__ = IntConstantView.__init__
+    name = IdentifierView.name
+    expr = property(lambda self: self._child(0))
+
+
+_VIEWS = (IntConstantView, BoolConstantView, IdentifierView, OpExprView,
+          AppExprView, IfExprView, LambdaExprView, DeclView)
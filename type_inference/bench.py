@@ -0,0 +1,189 @@
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+
+import module
+import parser
+import typing
+
+
+# Seeded generators of stress-shaped programs. Each takes a random.Random
+# and a size and returns source text: one declaration, except many_decls,
+# which returns a module.
+def deep_lambda(rng, n):
+    names = [f"a{i}" for i in range(n)]
+    body = " + ".join(rng.choice(names) for _ in range(4))
+    return "f = " + "".join(f"lambda {name} -> " for name in names) + body
+
+
+def wide_app(rng, n):
+    args = [rng.choice(("1", "true", "x", "(x + 1)", "x < 2")) for _ in range(n)]
+    return f"w g x = g({', '.join(args)})"
+
+
+def op_chain(rng, n):
+    ops = [f" {rng.choice('+-*%')} {rng.choice(('x', str(rng.randrange(100))))}"
+           for _ in range(n)]
+    return "c x = x" + "".join(ops)
+
+
+def if_ladder(rng, n):
+    rungs = [f"if x == {i} then {rng.randrange(100)} else " for i in range(n)]
+    return "l x = " + "".join(rungs) + "0"
+
+
+def many_decls(rng, n):
+    lines = ["d0 x = x + 1"]
+    for i in range(1, n):
+        j = rng.randrange(i)
+        k = rng.randrange(i)
+        lines.append(f"d{i} x = if d{j}(x) < d{k}(x) then x else d{j}(x) * 2")
+    return "\n".join(lines)
+
+
+SHAPES = {
+    "deep_lambda": (deep_lambda, (100, 200, 400)),
+    "wide_app": (wide_app, (1000, 4000, 16000)),
+    "op_chain": (op_chain, (1000, 4000, 16000)),
+    "if_ladder": (if_ladder, (500, 2000, 8000)),
+    "many_decls": (many_decls, (100, 400, 1600)),
+}
+
+DECL_STAGES = ("lex", "parse", "assign", "equations", "unify", "type")
+MODULE_STAGES = ("lex", "parse_module", "infer_module")
+
+
+def _timed(func, repeat):
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+# Times each stage of inferring `text` separately, feeding every stage the
+# previous stage's output. Returns {stage: seconds}, the best of `repeat`.
+def time_stages(text, is_module=False, repeat=3, solver="unionfind"):
+    p = parser.Parser()
+    times = {}
+
+    def lex():
+        p.lexer.input(text)
+        return sum(1 for _ in p.lexer.tokens())
+    times["lex"], _ = _timed(lex, repeat)
+
+    if is_module:
+        times["parse_module"], decls = _timed(lambda: p.parse_module(text), repeat)
+        times["infer_module"], (types, errors) = _timed(
+            lambda: module.infer_module(decls, max_workers=1), repeat)
+        if errors:
+            raise typing.TypingError(f"generated module is ill-typed: {errors}")
+        return times
+
+    times["parse"], decl = _timed(lambda: p.parse_decl(text), repeat)
+    ctx = typing.InferenceContext()
+    times["assign"], annotations = _timed(
+        lambda: typing.assign_typenames(decl.expr, ctx=ctx), repeat)
+
+    def equations():
+        eqs = []
+        typing.generate_equations(decl.expr, annotations, eqs)
+        return eqs
+    times["equations"], eqs = _timed(equations, repeat)
+    times["unify"], subst = _timed(
+        lambda: typing.unify_all_equations(eqs, solver, typing.InferenceContext()), repeat)
+    if subst is None:
+        raise typing.TypingError("generated declaration is ill-typed")
+    times["type"], _ = _timed(
+        lambda: typing.get_expression_type(decl.expr, annotations, subst,
+                                           rename_types=True), repeat)
+    return times
+
+
+# Runs every shape at every size (scaled by `scale`). Returns
+# {"shape/size/stage": seconds}.
+def run_suite(seed=0, scale=1.0, repeat=3, shapes=None, solver="unionfind"):
+    results = {}
+    for name, (generate, sizes) in SHAPES.items():
+        if shapes and name not in shapes:
+            continue
+        for size in sizes:
+            size = max(1, int(size * scale))
+            text = generate(random.Random(seed), size)
+            for stage, seconds in time_stages(text, name == "many_decls", repeat, solver).items():
+                results[f"{name}/{size}/{stage}"] = seconds
+    return results
+
+
+# Growth exponent of each shape's stages between its smallest and largest
+# size: about 1 for linear stages, 2 for quadratic ones.
+def scaling(results):
+    points = {}
+    for key, seconds in results.items():
+        name, size, stage = key.split("/")
+        points.setdefault((name, stage), []).append((int(size), seconds))
+    slopes = {}
+    for (name, stage), pts in points.items():
+        pts.sort()
+        (n0, t0), (n1, t1) = pts[0], pts[-1]
+        if n1 > n0 and t0 > 0 and t1 > 0:
+            slopes[f"{name}/{stage}"] = math.log(t1 / t0) / math.log(n1 / n0)
+    return slopes
+
+
+# Keys whose time grew beyond `tolerance` times the baseline. Differences
+# under `floor` seconds are timer noise and never count.
+def regressions(results, baseline, tolerance=1.5, floor=0.002):
+    return sorted(key for key, seconds in results.items()
+                  if key in baseline and seconds > baseline[key] * tolerance
+                  and seconds - baseline[key] > floor)
+
+
+def report(results, out=sys.stdout):
+    for key, seconds in results.items():
+        print(f"{key:40} {seconds * 1000:10.3f} ms", file=out)
+    print("\nscaling exponents", file=out)
+    for key, slope in scaling(results).items():
+        print(f"{key:40} {slope:6.2f}", file=out)
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("--seed", type=int, default=0)
+    argparser.add_argument("--scale", type=float, default=1.0,
+                           help="multiply every input size by this factor")
+    argparser.add_argument("--repeat", type=int, default=3)
+    argparser.add_argument("--shape", action="append", choices=sorted(SHAPES),
+                           help="run only this shape (may be repeated)")
+    argparser.add_argument("--solver", choices=typing.SOLVERS, default="unionfind")
+    argparser.add_argument("--baseline", default=BASELINE)
+    argparser.add_argument("--save", action="store_true",
+                           help="store the results as the new baseline")
+    argparser.add_argument("--tolerance", type=float, default=1.5,
+                           help="slowdown factor over the baseline that fails the run")
+    args = argparser.parse_args()
+
+    results = run_suite(args.seed, args.scale, args.repeat, args.shape, args.solver)
+    report(results)
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+        print(f"\nbaseline written to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        slower = regressions(results, baseline, args.tolerance)
+        for key in slower:
+            print(f"REGRESSION {key}: {baseline[key] * 1000:.3f} ms -> "
+                  f"{results[key] * 1000:.3f} ms", file=sys.stderr)
+        if slower:
+            sys.exit(1)
@@ -0,0 +1,86 @@
+import hashlib
+import os
+import pickle
+
+import ast
+
+
+# Hash of a declaration's normalised form: its AST in pre-order, so layout,
+# whitespace and parenthesisation do not matter.
+def decl_hash(decl):
+    h = hashlib.sha256()
+    stack = [decl]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, ast.Decl):
+            part = f"D {node.name}"
+        elif isinstance(node, ast.IntConstant):
+            part = f"I {node.value}"
+        elif isinstance(node, ast.BoolConstant):
+            part = f"B {node.value}"
+        elif isinstance(node, ast.Identifier):
+            part = f"V {node.name}"
+        elif isinstance(node, ast.OpExpr):
+            part = f"O {node.op}"
+        elif isinstance(node, ast.AppExpr):
+            part = f"A {len(node.args)}"
+        elif isinstance(node, ast.IfExpr):
+            part = "F"
+        elif isinstance(node, ast.LambdaExpr):
+            part = f"L {' '.join(node.argnames)}"
+        else:
+            raise TypeError(f"unknown node {type(node)}")
+        h.update(part.encode())
+        h.update(b"\0")
+        stack.extend(reversed(node._children))
+    return h.hexdigest()
+
+
+# Results of inferring strongly connected components, keyed by the hashes of
+# their declarations and the signatures of the declarations they depend on.
+# After an edit only components whose key changed miss: the edited
+# declarations and those dependents whose input signatures actually changed.
+# `reused` and `recomputed` list the declaration names of the last run.
+class InferenceCache:
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        self.used = set()
+        self.reused = []
+        self.recomputed = []
+        if path is not None and os.path.exists(path):
+            with open(path, "rb") as f:
+                self.entries = pickle.load(f)
+
+    def begin_run(self):
+        self.used = set()
+        self.reused = []
+        self.recomputed = []
+
+    def key(self, decls, env):
+        h = hashlib.sha256()
+        for decl in sorted(decls, key=lambda d: d.name):
+            h.update(decl_hash(decl).encode())
+        for name in sorted(env):
+            h.update(f"{name} :: {env[name]}\0".encode())
+        return h.hexdigest()
+
+    def get(self, key, names):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.used.add(key)
+            self.reused.extend(names)
+        return entry
+
+    def put(self, key, names, result, error):
+        self.entries[key] = (result, error)
+        self.used.add(key)
+        self.recomputed.extend(names)
+
+    # Writes the entries used by the last run; stale versions are dropped.
+    def save(self):
+        entries = {key: self.entries[key] for key in self.used}
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(entries, f)
+        os.replace(tmp, self.path)
@@ -0,0 +1,209 @@
+import concurrent.futures
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+import module
+import parser
+import typing
+
+# Records waiting between the workers and the writer; workers block when it
+# is full, so a slow reader holds back the pool instead of filling memory.
+QUEUE_SIZE = 4096
+
+_results = None
+
+
+def _init_worker(results):
+    global _results
+    module._init_worker()
+    _results = results
+
+
+# Files named by `paths`, walking directories in sorted order and skipping
+# hidden entries. Lazy, so a corpus is never listed whole.
+def iter_files(paths, suffix=""):
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            for name in sorted(files):
+                if name.endswith(suffix) and not name.startswith("."):
+                    yield os.path.join(root, name)
+
+
+# Checks the declarations of one file as a module with module.infer_module(),
+# passing `emit` a result per declaration as its component is done:
+# {"file", "name", "type" or "error", "ms"}, where "ms" is the time spent on
+# the declaration's component. A file that cannot be read or parsed, or
+# whose checking fails as a whole, gives {"file", "error"}; nothing a file
+# contains makes this raise.
+def check_file(path, emit, solver="deferred", p=None):
+    if p is None:
+        p = module._worker_parser or parser.Parser()
+
+    def finished(names, types, error, seconds):
+        ms = round(seconds * 1000, 3)
+        for name in names:
+            if error is None:
+                emit({"file": path, "name": name, "type": str(types[name]), "ms": ms})
+            else:
+                emit({"file": path, "name": name, "error": error, "ms": ms})
+
+    try:
+        module.infer_module(p.parse_file(path), max_workers=1, solver=solver,
+                            on_finish=finished)
+    except (OSError, UnicodeDecodeError, parser.ParseError, typing.TypingError) as e:
+        emit({"file": path, "error": str(e)})
+    except Exception as e:
+        emit({"file": path, "error": f"internal error: {type(e).__name__}: {e}"})
+
+
+# Runs in a pool worker: checks a batch of files, putting each result on the
+# queue as it comes and then ("done", batch) as each file is finished.
+def _check_files(batch, paths, solver):
+    for path in paths:
+        check_file(path, lambda result: _results.put(("result", result)), solver)
+        _results.put(("done", batch))
+
+
+# Checks every file under `paths` on a pool of `workers` processes, each with
+# a parser warmed once, and writes one JSON line per declaration to `out` as
+# soon as it is inferred. Files go to the workers `chunksize` at a time, at
+# most `max_in_flight` batches are submitted at once and files are listed
+# lazily, so memory stays flat however large the corpus. A batch whose
+# worker fails, for instance by being killed, gives an error for each of its
+# files not yet finished; a worker that dies takes the pool down, and with it
+# the other batches in flight, which fail the same way before a new pool
+# carries on. `start_method` picks the multiprocessing start method; workers
+# that do not fork need an `initializer` that can set up the module path,
+# such as type_inference.init_worker. Returns (declarations checked, errors).
+def run(paths, workers=None, chunksize=8, max_in_flight=None, solver="deferred",
+        suffix="", out=sys.stdout, start_method=None, initializer=_init_worker):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_in_flight is None:
+        max_in_flight = 2 * workers
+    context = multiprocessing.get_context(start_method)
+    results = context.Queue(QUEUE_SIZE)
+
+    def pool():
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=context, initializer=initializer,
+            initargs=(results,))
+
+    files = iter_files(paths, suffix)
+    batches = itertools.count()
+    pending = {}
+    checked = failed = 0
+
+    def write(result):
+        nonlocal checked, failed
+        out.write(json.dumps(result) + "\n")
+        checked += 1
+        failed += "error" in result
+
+    def fail(chunk, error):
+        for path in chunk:
+            write({"file": path, "error": f"worker failed: {error!r}"})
+
+    # A pending batch's chunk holds the files it has not finished, in order.
+    def take(kind, value):
+        if kind == "result":
+            write(value)
+        elif value in pending:
+            chunk = pending[value][1]
+            del chunk[0]
+            if not chunk:
+                del pending[value]
+
+    # Drops the batches whose worker raised, with an error for each file they
+    # did not finish. Returns whether the pool is broken, leaving its batches
+    # to restart(), which first reads what they reported.
+    def reap():
+        for batch, (future, chunk) in list(pending.items()):
+            if future.done() and future.exception() is not None:
+                if isinstance(future.exception(), concurrent.futures.BrokenExecutor):
+                    return True
+                del pending[batch]
+                fail(chunk, future.exception())
+        return False
+
+    # A worker that died may have held the queue's write lock, so a broken
+    # pool is replaced along with the queue. What can still be read from the
+    # old queue is written; the files it never finished reporting fail.
+    def restart():
+        nonlocal executor, results
+        executor.shutdown(wait=False)
+        while True:
+            try:
+                take(*results.get(timeout=0.1))
+            except Exception:
+                break
+        for future, chunk in pending.values():
+            error = future.exception() if future.done() and not future.cancelled() else None
+            fail(chunk, error or concurrent.futures.BrokenExecutor("worker pool was replaced"))
+        pending.clear()
+        results.close()
+        results = context.Queue(QUEUE_SIZE)
+        executor = pool()
+
+    executor = pool()
+    try:
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < max_in_flight:
+                chunk = list(itertools.islice(files, chunksize))
+                if chunk:
+                    batch = next(batches)
+                    pending[batch] = (executor.submit(_check_files, batch, chunk, solver),
+                                      list(chunk))
+                else:
+                    exhausted = True
+            if not pending:
+                break
+            try:
+                take(*results.get_nowait())
+            except queue.Empty:
+                out.flush()
+                try:
+                    take(*results.get(timeout=0.1))
+                except queue.Empty:
+                    if reap():
+                        restart()
+    finally:
+        out.flush()
+        executor.shutdown(wait=True)
+        results.close()
+    return checked, failed
+
+
+def add_arguments(argparser):
+    argparser.add_argument("paths", nargs="+", metavar="PATH",
+                           help="a file of declarations, or a directory of them")
+    argparser.add_argument("-j", "--workers", type=int, default=None,
+                           help="worker processes (default: one per CPU)")
+    argparser.add_argument("--chunksize", type=int, default=8,
+                           help="files handed to a worker at a time")
+    argparser.add_argument("--max-in-flight", type=int, default=None,
+                           help="batches submitted at once (default: twice the workers)")
+    argparser.add_argument("--solver", choices=typing.SOLVERS, default="deferred")
+    argparser.add_argument("--suffix", default="",
+                           help="in directories, only check files ending with this")
+    argparser.add_argument("--start-method", choices=multiprocessing.get_all_start_methods())
+
+
+def main(args, initializer=_init_worker):
+    start = time.perf_counter()
+    checked, failed = run(args.paths, args.workers, args.chunksize, args.max_in_flight,
+                          args.solver, args.suffix, sys.stdout, args.start_method,
+                          initializer)
+    print(f"checked {checked} declarations, {failed} errors, "
+          f"in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+    return 1 if failed else 0
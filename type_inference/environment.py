@@ -0,0 +1,42 @@
+# A scoped symbol table. Lookups see the innermost binding of a name, then
+# `globals`, which is referenced rather than copied, so a large pre-populated
+# table (builtin signatures, a module's inferred declarations, or a ChainMap
+# of several) costs nothing to use. Entering and leaving a scope costs one
+# step per name it binds; lookups are a single dict probe.
+class Environment:
+    def __init__(self, globals=None):
+        self.globals = {} if globals is None else globals
+        self.locals = {}
+        self.scopes = []
+
+    def push_scope(self, bindings):
+        names = list(bindings)
+        for name in names:
+            self.locals.setdefault(name, []).append(bindings[name])
+        self.scopes.append(names)
+
+    def pop_scope(self):
+        for name in self.scopes.pop():
+            shadowed = self.locals[name]
+            shadowed.pop()
+            if not shadowed:
+                del self.locals[name]
+
+    # Pops scopes until `depth` are left; used to unwind after an error.
+    def unwind(self, depth):
+        while len(self.scopes) > depth:
+            self.pop_scope()
+
+    def __contains__(self, name):
+        return name in self.locals or name in self.globals
+
+    def __getitem__(self, name):
+        shadowed = self.locals.get(name)
+        if shadowed:
+            return shadowed[-1]
+        return self.globals[name]
+
+    def get(self, name, default=None):
+        if name in self:
+            return self[name]
+        return default
@@ -0,0 +1,104 @@
+import weakref
+
+import ast
+
+
+# Hash-consing of closed subtrees: a parser given this table as `share`
+# builds its nodes through it, and a subtree with no free names that is
+# structurally identical to one built before is returned as the same object.
+# Nodes compare by identity, so a shared subtree can key the memo of
+# principal types kept here for typing.InferenceContext(subtrees=...).
+#   ids       structure (kind, payload, child structure ids) -> structure id
+#   info      node -> (structure id, free names)
+#   shared    structure id -> the node of a closed subtree
+#   closed    the shared nodes
+#   types     shared node -> its principal TypeScheme, filled by inference
+#   lookups   principal types asked for; misses are those inferred, so
+#             hits = lookups - misses
+# Declarations are not shared; a Decl's expression may be.
+#
+# Nodes are held weakly, so a subtree and its memoised type go once no
+# parsed tree uses it. Once `ids` outgrows `max_structures`, structures with
+# no live shared node are dropped from it; structure ids are never reused,
+# so that only loses sharing with trees that are gone.
+class SubtreeTable:
+    def __init__(self, max_structures=1 << 20):
+        self.ids = {}
+        self.next_id = 0
+        self.max_structures = max_structures
+        self.limit = max_structures
+        self.info = weakref.WeakKeyDictionary()
+        self.shared = weakref.WeakValueDictionary()
+        self.closed = weakref.WeakSet()
+        self.types = weakref.WeakKeyDictionary()
+        self.reused = 0
+        self.lookups = 0
+        self.misses = 0
+
+    @property
+    def hits(self):
+        return self.lookups - self.misses
+
+    def _node(self, cls, payload, children, free, *args):
+        key = (cls, payload, tuple(self.info[c][0] for c in children))
+        sid = self.ids.get(key)
+        if sid is None:
+            if len(self.ids) >= self.limit:
+                self._prune()
+            sid = self.ids[key] = self.next_id
+            self.next_id += 1
+        elif not free:
+            node = self.shared.get(sid)
+            if node is not None:
+                self.reused += 1
+                return node
+        node = cls(*args)
+        self.info[node] = (sid, free)
+        if not free:
+            self.shared[sid] = node
+            self.closed.add(node)
+        return node
+
+    def _prune(self):
+        live = set(self.shared.keys())
+        self.ids = {key: sid for key, sid in self.ids.items() if sid in live}
+        self.limit = max(self.max_structures, 2 * len(self.ids))
+
+    def _free(self, children):
+        free = frozenset()
+        for c in children:
+            names = self.info[c][1]
+            if names:
+                free = free | names
+        return free
+
+    def IntConstant(self, value):
+        return self._node(ast.IntConstant, value, (), frozenset(), value)
+
+    def BoolConstant(self, value):
+        return self._node(ast.BoolConstant, value, (), frozenset(), value)
+
+    def Identifier(self, name):
+        return self._node(ast.Identifier, name, (), frozenset((name,)), name)
+
+    def OpExpr(self, op, left, right):
+        children = (left, right)
+        return self._node(ast.OpExpr, op, children, self._free(children), op, left, right)
+
+    def AppExpr(self, func, args=None):
+        children = (func, *args)
+        return self._node(ast.AppExpr, None, children, self._free(children), func, args)
+
+    def IfExpr(self, ifexpr, thenexpr, elseexpr):
+        children = (ifexpr, thenexpr, elseexpr)
+        return self._node(ast.IfExpr, None, children, self._free(children),
+                          ifexpr, thenexpr, elseexpr)
+
+    def LambdaExpr(self, argnames, expr):
+        free = self.info[expr][1]
+        if free:
+            free = free.difference(argnames)
+        return self._node(ast.LambdaExpr, tuple(argnames), (expr,), free, argnames, expr)
+
+    def Decl(self, name, expr):
+        return ast.Decl(name, expr)
@@ -0,0 +1,226 @@
+import hashlib
+import mmap
+import os
+import struct
+
+import cache
+import module
+import typing
+
+MAGIC = b"TIIF"
+VERSION = 1
+
+# File layout, little-endian:
+#   header   magic, u16 version, u32 entry count
+#   index    one record per declaration, sorted by name: u32 name offset,
+#            u16 name length, u32 signature offset, u32 signature length and
+#            the 32-byte dependency hash; offsets are from the file start
+#   data     names (UTF-8) and encoded signatures
+# A signature is the declaration's generalised type with its variables
+# numbered canonically, as rename_typevars() does, in prefix form: 0 Int,
+# 1 Bool, 2 and a varint for variable n, 3 and a varint argument count for a
+# function type, followed by its argument and return types.
+_HEADER = struct.Struct("<4sHI")
+_RECORD = struct.Struct("<IHII32s")
+
+_INT, _BOOL, _VAR, _FUNC = range(4)
+
+
+def _put_varint(out, n):
+    while n >= 0x80:
+        out.append(n & 0x7F | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _get_varint(buf, pos):
+    n = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def encode_type(typ):
+    out = bytearray()
+    stack = [typing.rename_typevars(typ)]
+    while stack:
+        t = stack.pop()
+        if isinstance(t, typing.IntType):
+            out.append(_INT)
+        elif isinstance(t, typing.BoolType):
+            out.append(_BOOL)
+        elif isinstance(t, typing.TypeVar):
+            out.append(_VAR)
+            _put_varint(out, t.id)
+        else:
+            out.append(_FUNC)
+            _put_varint(out, len(t.argtypes))
+            stack.append(t.rettype)
+            stack.extend(reversed(t.argtypes))
+    return bytes(out)
+
+
+def decode_type(buf, pos=0):
+    # Each frame is [function arity, decoded parts]; a finished term is
+    # appended to the parts of the frame below it.
+    frames = [[1, []]]
+    while True:
+        code = buf[pos]
+        pos += 1
+        if code == _INT:
+            t = typing.IntType()
+        elif code == _BOOL:
+            t = typing.BoolType()
+        elif code == _VAR:
+            n, pos = _get_varint(buf, pos)
+            t = typing.TypeVar(n, chr(ord("a") + n))
+        elif code == _FUNC:
+            n, pos = _get_varint(buf, pos)
+            frames.append([n + 1, []])
+            continue
+        else:
+            raise ValueError(f"bad type code {code} at {pos - 1}")
+        while True:
+            arity, parts = frames[-1]
+            parts.append(t)
+            if len(parts) < arity:
+                break
+            frames.pop()
+            if not frames:
+                return t, pos
+            t = typing.FuncType(parts[:-1], parts[-1])
+
+
+# Hash of a declaration's source structure and the signatures of the
+# declarations it refers to, up to renaming of their variables; an interface
+# entry whose hash no longer matches is stale.
+def dependency_hash(decl, deps):
+    h = hashlib.sha256(cache.decl_hash(decl).encode())
+    for name in sorted(deps):
+        h.update(f"\0{name} :: {typing.type_hash(deps[name])}".encode())
+    return h.digest()
+
+
+# Writes an interface for the well-typed declarations of a module: `types`
+# as returned by module.infer_module(), `env` the signatures it was given
+# for names defined elsewhere.
+def write_interface(path, decls, types, env=None):
+    if env is None:
+        env = {}
+    entries = []
+    for decl in decls:
+        if decl.name not in types:
+            continue
+        deps = {}
+        for name in module.free_names(decl.expr):
+            if name in types:
+                deps[name] = types[name]
+            elif name in env:
+                deps[name] = env[name]
+        entries.append((decl.name, types[decl.name], dependency_hash(decl, deps)))
+    write_entries(path, entries)
+
+
+# Writes (name, signature, dependency hash) entries, replacing the file
+# atomically.
+def write_entries(path, entries):
+    entries = sorted(entries, key=lambda e: e[0].encode())
+    names = [name.encode() for name, _, _ in entries]
+    sigs = [encode_type(typ) for _, typ, _ in entries]
+    offset = _HEADER.size + _RECORD.size * len(entries)
+    index = []
+    for name, sig, (_, _, digest) in zip(names, sigs, entries):
+        index.append(_RECORD.pack(offset, len(name), offset + len(name), len(sig), digest))
+        offset += len(name) + len(sig)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(entries)))
+        f.writelines(index)
+        for name, sig in zip(names, sigs):
+            f.write(name)
+            f.write(sig)
+    os.replace(tmp, path)
+
+
+# A memory-mapped interface file, read as a mapping from declaration names to
+# signatures. Opening reads only the header; a lookup binary-searches the
+# index and decodes just the entry it finds, once. Usable directly as the
+# `env` of module.infer_module() or typing.infer_decls().
+class Interface:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count = _HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            self.buf.close()
+            raise ValueError(f"{path} is not a version {VERSION} interface file")
+        self.decoded = {}
+
+    def _record(self, i):
+        return _RECORD.unpack_from(self.buf, _HEADER.size + _RECORD.size * i)
+
+    def _name(self, record):
+        return self.buf[record[0]:record[0] + record[1]]
+
+    # Index of `name`, or -1.
+    def _find(self, name):
+        key = name.encode()
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._name(self._record(mid)) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self._name(self._record(lo)) == key:
+            return lo
+        return -1
+
+    def __contains__(self, name):
+        return name in self.decoded or self._find(name) >= 0
+
+    def __getitem__(self, name):
+        typ = self.decoded.get(name)
+        if typ is None:
+            i = self._find(name)
+            if i < 0:
+                raise KeyError(name)
+            record = self._record(i)
+            typ, _ = decode_type(self.buf, record[2])
+            typ = self.decoded[name] = typing.canonical_type(typ)
+        return typ
+
+    def get(self, name, default=None):
+        if name in self:
+            return self[name]
+        return default
+
+    def dep_hash(self, name):
+        i = self._find(name)
+        if i < 0:
+            raise KeyError(name)
+        return self._record(i)[4]
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self._name(self._record(i)).decode()
+
+    def __len__(self):
+        return self.count
+
+    def keys(self):
+        return iter(self)
+
+    def close(self):
+        self.buf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
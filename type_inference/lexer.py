@@ -1,20 +1,40 @@
+import codecs
+import functools
+import mmap
+import os
 import re
 import sys
 
+# Characters decoded per chunk when lexing a file or stream.
+CHUNK_SIZE = 1 << 20
 
+# Characters that must follow a pattern token in the window before it is
+# taken from a chunked input, as a pattern may need them to match further
+# (`\d+\.\d+` against `12.5` cut after `12.`).
+PATTERN_LOOKAHEAD = 4
+
+
+# `pos` is the character offset in the input; `line` and `col` count from 1
+# and are set by TrieLexer.
 class Token(object):
-    def __init__(self, typ, val, pos):
+    __slots__ = ("typ", "val", "pos", "line", "col")
+
+    def __init__(self, typ, val, pos, line=None, col=None):
         self.typ = typ
         self.val = val
         self.pos = pos
+        self.line = line
+        self.col = col
 
     def __str__(self):
         return f"{self.typ}({self.val}) @ {self.pos}"
 
 
 class LexerError(Exception):
-    def __init__(self, pos):
+    def __init__(self, pos, line=None, col=None):
         self.pos = pos
+        self.line = line
+        self.col = col
 
 
 class Lexer(object):
@@ -26,12 +46,12 @@ class Lexer(object):
         for regex, typ in rules:
             groupname = f"GROUP{idx}"
             regex_parts.append(f"(?P<{groupname}>{regex})")
-            self.group_type[groupname] = type
+            self.group_type[groupname] = typ
             idx += 1
 
         self.regex = re.compile("|".join(regex_parts))
         self.skip_whitesapce = skip_whitesapce
-        self.re_ws_skip = re.compile("\S")
+        self.re_ws_skip = re.compile(r"\S")
 
     def input(self, buf):
         self.buf = buf
@@ -54,38 +74,384 @@ class Lexer(object):
                 groupname = m.lastgroup
                 tok_type = self.group_type[groupname]
                 tok = Token(tok_type, m.group(groupname), self.pos)
-                self.po = m.end()
-                return tok_type
+                self.pos = m.end()
+                return tok
 
             raise LexerError(self.pos)
 
     def tokens(self):
         while True:
             tok = self.token()
-            if toke is None:
+            if tok is None:
+                break
+            yield tok
+
+
+# Tables generated once per rule table by compile_rules():
+#   type_names  token type name for each type id, in order of first use
+#   keywords    pattern rule index -> {lexeme: type id} for literal rules
+#               that the pattern also matches and that come before it, e.g.
+#               "if" against the identifier rule
+#   trie        the other literal rules as nested dicts; the None key of a
+#               node holds (rule index, type id) of the literal ending there
+#   dispatch    first character -> pattern rules that can start with it
+#   generic     pattern rules whose first character could not be determined
+#   patterns    all pattern rules, tried for characters outside ASCII
+#   regex       the tables lowered to one regex, when no two sources (the
+#               trie or a pattern) share a first character; literals are
+#               ordered longest first, so leftmost alternation is longest match
+#   group_type  regex group index -> (rule index, type id)
+#   lookahead   characters of input past a token a chunked window must hold
+#               before the token is taken: the longest trie literal, or
+#               PATTERN_LOOKAHEAD if that is longer and there are patterns
+class LexerTables(object):
+    def __init__(self, type_names, keywords, trie, dispatch, generic,
+                 patterns, regex, group_type, lookahead):
+        self.type_names = type_names
+        self.keywords = keywords
+        self.trie = trie
+        self.dispatch = dispatch
+        self.generic = generic
+        self.patterns = patterns
+        self.regex = regex
+        self.group_type = group_type
+        self.lookahead = lookahead
+
+
+# The text a regex matches if it is a plain (possibly escaped) literal.
+def _literal(regex):
+    text = []
+    i = 0
+    while i < len(regex):
+        c = regex[i]
+        if c == "\\":
+            if i + 1 == len(regex) or regex[i + 1].isalnum():
+                return None
+            text.append(regex[i + 1])
+            i += 2
+        elif c in ".^$*+?{}[]|()":
+            return None
+        else:
+            text.append(c)
+            i += 1
+    return "".join(text)
+
+
+@functools.lru_cache(maxsize=None)
+def compile_rules(rules, skip_whitespace=True):
+    type_names = []
+    type_ids = {}
+    literals = []
+    patterns = []
+    for index, (regex, typ) in enumerate(rules):
+        if typ not in type_ids:
+            type_ids[typ] = len(type_names)
+            type_names.append(typ)
+        text = _literal(regex)
+        if text is not None:
+            literals.append((text, index, type_ids[typ]))
+        else:
+            patterns.append((index, type_ids[typ], re.compile(regex)))
+
+    keywords = {}
+    trie = {}
+    trie_literals = []
+    for text, index, type_id in literals:
+        matching = [p for p in patterns if p[2].fullmatch(text)]
+        if not matching:
+            trie_literals.append((text, index, type_id))
+            node = trie
+            for c in text:
+                node = node.setdefault(c, {})
+            node.setdefault(None, (index, type_id))
+        elif index < matching[0][0]:
+            keywords.setdefault(matching[0][0], {}).setdefault(text, type_id)
+
+    dispatch = {}
+    generic = []
+    for pattern in patterns:
+        starts = [chr(c) for c in range(128) if pattern[2].match(chr(c))]
+        if starts:
+            for c in starts:
+                dispatch.setdefault(c, []).append(pattern)
+        else:
+            generic.append(pattern)
+    for c in dispatch:
+        dispatch[c].extend(generic)
+
+    regex = None
+    group_type = {}
+    if not generic and all(len(ps) == 1 and c not in trie for c, ps in dispatch.items()):
+        alternatives = []
+        group = 1
+        trie_literals.sort(key=lambda lit: (-len(lit[0]), lit[1]))
+        for text, index, type_id in trie_literals:
+            alternatives.append(f"({re.escape(text)})")
+            group_type[group] = (index, type_id)
+            group += 1
+        for index, type_id, rx in patterns:
+            alternatives.append(f"({rx.pattern})")
+            group_type[group] = (index, type_id)
+            group += 1 + rx.groups
+        prefix = r"\s*" if skip_whitespace else ""
+        regex = re.compile(f"{prefix}(?:{'|'.join(alternatives)})")
+    lookahead = max([1] + [len(text) for text, index, type_id in trie_literals])
+    if patterns:
+        lookahead = max(lookahead, PATTERN_LOOKAHEAD)
+    return LexerTables(type_names, keywords, trie, dispatch, generic,
+                       patterns, regex, group_type, lookahead)
+
+
+# Decoded text of `stream` (binary or text, anything with read(n)) in chunks.
+def _stream_chunks(stream, chunk_size, encoding):
+    decoder = None
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        if isinstance(chunk, bytes):
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder(encoding)()
+            chunk = decoder.decode(chunk)
+        yield chunk
+    if decoder is not None:
+        yield decoder.decode(b"", final=True)
+
+
+def _file_chunks(path, chunk_size, encoding):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            yield from _stream_chunks(m, chunk_size, encoding)
+
+
+# Lexer generated from a rule table: literal rules go to a trie or, when an
+# identifier-like rule also matches them, to a keyword table; the others are
+# dispatched on their first character. Matching is longest-match with rule
+# order breaking ties, so `iffy` is one ID rather than IF followed by `fy`.
+# Has the interface of Lexer, plus tokenize_all() and input from files and
+# streams.
+#
+# Input read with input_file() or input_stream() is decoded a chunk at a time
+# and only the unconsumed tail is kept: `buf` holds the text from offset
+# `base` on. A token is only taken once a few characters follow it in the
+# window (or the input has ended), so none is cut or shortened at a chunk
+# boundary, and memory stays near the chunk size plus the current token.
+class TrieLexer(object):
+    def __init__(self, rules, skip_whitesapce=True):
+        self.tables = compile_rules(tuple(rules), skip_whitesapce)
+        self.skip_whitesapce = skip_whitesapce
+        self.input("")
+
+    def input(self, buf):
+        self._start(buf, None)
+
+    # Lexes the file at `path` through a read-only memory map.
+    def input_file(self, path, chunk_size=CHUNK_SIZE, encoding="utf-8"):
+        self._start("", _file_chunks(path, chunk_size, encoding))
+
+    # Lexes what `stream.read(chunk_size)` returns until it returns nothing.
+    def input_stream(self, stream, chunk_size=CHUNK_SIZE, encoding="utf-8"):
+        self._start("", _stream_chunks(stream, chunk_size, encoding))
+
+    def _start(self, buf, chunks):
+        self.buf = buf
+        self.pos = 0
+        self.chunks = chunks
+        self.base = 0
+        # Line tracking: newlines before offset `scanned` are counted in
+        # `line`, and the last of them ends at `line_start`.
+        self.line = 1
+        self.line_start = 0
+        self.scanned = 0
+
+    # Line and column of offset `pos`, at or after the last offset located.
+    def locate(self, pos):
+        lo = self.scanned - self.base
+        hi = pos - self.base
+        n = self.buf.count("\n", lo, hi)
+        if n:
+            self.line += n
+            self.line_start = self.base + self.buf.rindex("\n", lo, hi) + 1
+        self.scanned = pos
+        return self.line, pos - self.line_start + 1
+
+    # Appends the next chunk, dropping the text before `pos`, whose newlines
+    # are counted first. Returns False at the end of the input.
+    def _fill(self, pos):
+        if self.chunks is None:
+            return False
+        for chunk in self.chunks:
+            if chunk:
+                break
+        else:
+            self.chunks = None
+            return False
+        self.locate(self.base + pos)
+        self.buf = self.buf[pos:] + chunk
+        self.base += pos
+        self.pos = 0
+        return True
+
+    # _next() over a window of the input: a token, or the end of the input,
+    # is only trusted once tables.lookahead characters past it have been
+    # read, since a longer match could need them; until then it is matched
+    # again over a larger window. A lexing error is retried the same way, and
+    # once more with another chunk, in case the text was cut mid-token.
+    def _next_chunked(self):
+        lookahead = self.tables.lookahead
+        refilled = False
+        while True:
+            start = self.pos
+            try:
+                tok = self._next()
+            except LexerError as e:
+                if len(self.buf) - e.pos < lookahead and self._fill(start):
+                    continue
+                if not refilled and self._fill(start):
+                    refilled = True
+                    continue
+                pos = self.base + e.pos
+                raise LexerError(pos, *self.locate(pos))
+            if len(self.buf) - self.pos < lookahead and self._fill(start):
+                continue
+            if tok is None:
+                return None
+            return tok[0], tok[1], self.base + tok[2]
+
+    def _skip(self, buf, pos):
+        if self.skip_whitesapce:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+        return pos
+
+    # Longest match at `pos` by walking the tables: returns (type id, end).
+    def _match(self, buf, pos):
+        tables = self.tables
+        best = None
+        best_end = pos
+
+        node = tables.trie
+        i = pos
+        while i < len(buf) and buf[i] in node:
+            node = node[buf[i]]
+            i += 1
+            if None in node:
+                best, best_end = node[None], i
+
+        if buf[pos] < "\x80":
+            candidates = tables.dispatch.get(buf[pos], tables.generic)
+        else:
+            candidates = tables.patterns
+        for index, type_id, rx in candidates:
+            m = rx.match(buf, pos)
+            if m is None:
+                continue
+            end = m.end()
+            if end > best_end or end == best_end and best is not None and index < best[0]:
+                best, best_end = (index, type_id), end
+
+        if best is None or best_end == pos:
+            raise LexerError(pos)
+        type_id = best[1]
+        if best[0] in tables.keywords:
+            type_id = tables.keywords[best[0]].get(buf[pos:best_end], type_id)
+        return type_id, best_end
+
+    # Next token as (type id, value, position), or None at the end.
+    def _next(self):
+        buf = self.buf
+        tables = self.tables
+        if tables.regex is not None:
+            m = tables.regex.match(buf, self.pos)
+            if m is None:
+                self.pos = self._skip(buf, self.pos)
+                if self.pos < len(buf):
+                    raise LexerError(self.pos)
+                return None
+            index, type_id = tables.group_type[m.lastindex]
+            val = m.group(m.lastindex)
+            if index in tables.keywords:
+                type_id = tables.keywords[index].get(val, type_id)
+            self.pos = m.end()
+            return type_id, val, m.start(m.lastindex)
+
+        pos = self._skip(buf, self.pos)
+        if pos >= len(buf):
+            self.pos = pos
+            return None
+        type_id, self.pos = self._match(buf, pos)
+        return type_id, buf[pos:self.pos], pos
+
+    def token(self):
+        tok = self._next_chunked()
+        if tok is None:
+            return None
+        return Token(self.tables.type_names[tok[0]], tok[1], tok[2], *self.locate(tok[2]))
+
+    def tokens(self):
+        while True:
+            tok = self.token()
+            if tok is None:
                 break
             yield tok
 
-    if __name__ == '__main__':
-        rules = [
-            ("\d+", "NUMBER"),
-            ("[a-zA-Z]\w+", "ID"),
-            ("\+", "PLUS"),
-            ("\-", "MINUS"),
-            ("\*", "MUL"),
-            ("\/", "DIV"),
-            ("\%", "MOD"),
-            ("\(", "LPAREN"),
-            ("\)", "RPAREN"),
-            ("==", "EQ"),
-            ("=", "ASSIGN"),
-        ]
-
-        lx = Lexer(rules, skip_whitesapce=True)
-        lx.input("erw = _abc + 12*(R4=623902)   ")
-
-        try:
-            for tok in lx.tokens():
-                print(tok)
-        except LexerError as err:
-            print(f"LexerError at posistion {err.pos}")
+    # Lexes the whole buffer in one pass. Tokens are compact
+    # (type id, value, position) tuples; tables.type_names maps ids to names.
+    def tokenize_all(self, buf=None):
+        if buf is not None:
+            self.input(buf)
+        tables = self.tables
+        if self.chunks is not None:
+            return list(iter(self._next_chunked, None))
+        if tables.regex is None:
+            return list(iter(self._next, None))
+
+        buf = self.buf
+        pos = self.pos
+        match = tables.regex.match
+        group_type = tables.group_type
+        keywords = tables.keywords
+        toks = []
+        append = toks.append
+        while True:
+            m = match(buf, pos)
+            if m is None:
+                break
+            g = m.lastindex
+            index, type_id = group_type[g]
+            val = m.group(g)
+            if index in keywords:
+                type_id = keywords[index].get(val, type_id)
+            append((type_id, val, m.start(g)))
+            pos = m.end()
+        self.pos = self._skip(buf, pos)
+        if self.pos < len(buf):
+            raise LexerError(self.pos)
+        return toks
+
+
+if __name__ == '__main__':
+    rules = [
+        (r"\d+", "NUMBER"),
+        (r"[a-zA-Z]\w+", "ID"),
+        (r"\+", "PLUS"),
+        (r"\-", "MINUS"),
+        (r"\*", "MUL"),
+        (r"\/", "DIV"),
+        (r"\%", "MOD"),
+        (r"\(", "LPAREN"),
+        (r"\)", "RPAREN"),
+        ("==", "EQ"),
+        ("=", "ASSIGN"),
+    ]
+
+    lx = Lexer(rules, skip_whitesapce=True)
+    lx.input("erw = _abc + 12*(R4=623902)   ")
+
+    try:
+        for tok in lx.tokens():
+            print(tok)
+    except LexerError as err:
+        print(f"LexerError at posistion {err.pos}")
@@ -1,25 +1,93 @@
+import argparse
+
 import ast
+import hashcons
 import parser
+import render
 import typing
 
+
+def infer_listed(e, annotations, ctx, solver, simplify):
+    with ctx.stats.phase("assign"):
+        typing.assign_typenames(e.expr, annotations=annotations, ctx=ctx)
+    print(f"Typename assignment is\n{typing.show_type_assignment(e.expr, annotations)}")
+
+    equations = []
+    with ctx.stats.phase("equations"):
+        typing.generate_equations(e.expr, annotations, equations, ctx)
+    if simplify:
+        with ctx.stats.phase("simplify"):
+            equations = typing.simplify_equations(equations, ctx.stats)
+    print("These are equations.")
+
+    for eq in equations:
+        print(f"{render.to_string(eq.left, max_width=40):15} "
+              f"{render.to_string(eq.right, max_width=60):20} | "
+              f"{render.to_string(eq.orig_node, max_width=60)}")
+
+    with ctx.stats.phase("unify"):
+        return typing.unify_stream(equations, solver, ctx)
+
+
+def infer_streaming(e, annotations, ctx, solver, simplify):
+    with ctx.stats.phase("assign"):
+        typing.assign_typenames(e.expr, annotations=annotations, ctx=ctx)
+    equations = typing.iter_equations(e.expr, annotations, ctx)
+    if simplify:
+        with ctx.stats.phase("simplify"):
+            equations = typing.simplify_equations(equations, ctx.stats)
+    with ctx.stats.phase("solve"):
+        return typing.unify_stream(equations, solver, ctx)
+
+
 if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("--equations", action="store_true",
+                           help="build and print the full equation list before solving")
+    argparser.add_argument("--solver", choices=typing.SOLVERS, default="unionfind",
+                           help="deferred checks for infinite types after solving, "
+                                "which is faster but locates the error less precisely")
+    argparser.add_argument("--simplify", action="store_true",
+                           help="drop redundant equations and collapse aliases before solving")
+    argparser.add_argument("--share", action="store_true",
+                           help="share repeated closed subexpressions across inputs and "
+                                "infer each once")
+    argparser.add_argument("--stats", action="store_true",
+                           help="print phase timings and inference counters")
+    args = argparser.parse_args()
+    subtrees = hashcons.SubtreeTable() if args.share else None
+
     while True:
         code = input("Please input your code")
 
-        p = parser.Parser()
-        e = p.parse_decl(code)
-        print(f"Parsed code is\n {e}")
-
-        typing.assign_typenames(e.expr)
-        print(f"Typename assignment is\n{typing.show_type_assignment(e.expr)}")
-
-        equations = []
-        typing.generate_equations(e.expr, equations)
-        print("These are equations.")
+        ctx = typing.InferenceContext(typing.Stats() if args.stats else None, subtrees)
+        p = parser.Parser(share=subtrees)
+        with ctx.stats.phase("parse"):
+            e = p.parse_decl(code)
+        print(f"Parsed code is\n {render.to_string(e, max_width=2000)}")
 
-        for eq in equations:
-            print(f"{str(eq.left):15} {str(eq.right):20} | {eq.orig_node}")
+        annotations = typing.Annotations()
+        if args.equations:
+            unifier, conflict = infer_listed(e, annotations, ctx, args.solver, args.simplify)
+        else:
+            unifier, conflict = infer_streaming(e, annotations, ctx, args.solver, args.simplify)
 
+        if conflict is not None:
+            print(f"Type error: {conflict}")
+        else:
+            if args.equations:
+                with ctx.stats.phase("resolve"):
+                    resolved = typing.resolve_all(e.expr, annotations, unifier, ctx.stats)
+                print(f"Resolved types are\n{typing.show_type_assignment(e.expr, resolved)}")
+            with ctx.stats.phase("type"):
+                typ = typing.get_expression_type(e.expr, annotations, unifier,
+                                                 rename_types=True, ctx=ctx)
+            print(f"Inferred type, {typ}")
 
-        unifier = typing.unify_all_equations(equations)
-        print(f"Inferred typek, {typing.get_expression_type(e.expr, unifier, rename_types=True)}")
+        if args.stats:
+            ctx.stats.count("tokens", p.tokens_lexed)
+            ctx.stats.count_nodes(e)
+            if subtrees is not None:
+                ctx.stats.count("memo_hits", subtrees.hits)
+                ctx.stats.count("memo_misses", subtrees.misses)
+            print(f"Statistics\n{ctx.stats.report()}")
@@ -0,0 +1,298 @@
+import concurrent.futures
+import time
+
+import ast
+import environment
+import parser
+import typing
+
+
+# Names referenced by `expr` that are not bound by an enclosing lambda.
+def free_names(expr):
+    names = set()
+    bound = environment.Environment()
+    stack = [expr]
+    while stack:
+        node = stack.pop()
+        if node is None:
+            bound.pop_scope()
+        elif isinstance(node, ast.Identifier):
+            if node.name not in bound:
+                names.add(node.name)
+        elif isinstance(node, ast.LambdaExpr):
+            bound.push_scope(dict.fromkeys(node.argnames))
+            stack.append(None)
+            stack.append(node.expr)
+        else:
+            stack.extend(node._children)
+    return names
+
+
+def reference_graph(decls):
+    names = set()
+    for decl in decls:
+        if decl.name in names:
+            raise typing.TypingError(f"duplicate declaration {decl.name}")
+        names.add(decl.name)
+    return {decl.name: sorted(free_names(decl.expr) & names) for decl in decls}
+
+
+# Tarjan's algorithm with an explicit stack. Components come out in
+# dependency order: every component follows the components it refers to.
+def strongly_connected_components(graph):
+    index = {}
+    lowlink = {}
+    on_stack = set()
+    stack = []
+    sccs = []
+
+    for root in graph:
+        if root in index:
+            continue
+        work = [(root, iter(graph[root]))]
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            v, succs = work[-1]
+            for w in succs:
+                if w not in index:
+                    index[w] = lowlink[w] = len(index)
+                    stack.append(w)
+                    on_stack.add(w)
+                    work.append((w, iter(graph[w])))
+                    break
+                elif w in on_stack:
+                    lowlink[v] = min(lowlink[v], index[w])
+            else:
+                work.pop()
+                if work:
+                    u = work[-1][0]
+                    lowlink[u] = min(lowlink[u], lowlink[v])
+                if lowlink[v] == index[v]:
+                    scc = []
+                    while True:
+                        w = stack.pop()
+                        on_stack.discard(w)
+                        scc.append(w)
+                        if w == v:
+                            break
+                    sccs.append(sorted(scc))
+    return sccs
+
+
+_worker_parser = None
+
+
+def _init_worker():
+    global _worker_parser
+    _worker_parser = parser.Parser()
+
+
+# Infers one component, returning (types, error, seconds taken). An
+# exception other than TypingError is a bug, but it is still reported as the
+# component's error, so that one declaration cannot abort a whole module.
+def _infer_component(decls, env, solver, subtrees=None):
+    start = time.perf_counter()
+    try:
+        result, error = typing.infer_decls(decls, env, solver=solver, subtrees=subtrees), None
+    except typing.TypingError as e:
+        result, error = None, str(e)
+    except Exception as e:
+        result, error = None, f"internal error: {type(e).__name__}: {e}"
+    return result, error, time.perf_counter() - start
+
+
+# Runs in a pool worker: each item is (decl sources of one SCC, env).
+def _infer_chunk(batch, solver):
+    return [_infer_component([_worker_parser.parse_decl(src) for src in sources], env, solver)
+            for sources, env in batch]
+
+
+def _infer_one(decl, env):
+    try:
+        return typing.infer_decls([decl], env)[decl.name], None
+    except typing.TypingError as e:
+        return None, str(e)
+
+
+# Runs in a pool worker: each item is (decl source, env).
+def _infer_sources(batch):
+    return [_infer_one(_worker_parser.parse_decl(src), env) for src, env in batch]
+
+
+# Infers independent declarations, each against `env` (a dict of closed
+# signatures) and in its own typing.InferenceContext, so results and variable
+# numbering do not depend on scheduling. With executor="thread" the parsed
+# ASTs are shared by a thread pool; with "process", workers re-parse
+# `sources` (one text per decl) in chunks of `chunksize`. Returns a list of
+# (signature, error) pairs in the order of `decls`.
+def infer_batch(decls, env=None, sources=None, executor="thread",
+                max_workers=None, chunksize=16):
+    if env is None:
+        env = {}
+    if executor == "thread":
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(_infer_one, decls, [env] * len(decls)))
+
+    elif executor == "process":
+        if sources is None:
+            raise ValueError("a process pool needs the declarations' sources")
+        chunks = [[(src, env) for src in sources[i:i + chunksize]]
+                  for i in range(0, len(sources), chunksize)]
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=max_workers, initializer=_init_worker) as pool:
+            return [result for chunk in pool.map(_infer_sources, chunks)
+                    for result in chunk]
+
+    else:
+        raise ValueError(f"unknown executor {executor}")
+
+
+# Infers every declaration of a module, one strongly connected component at a
+# time in dependency order. Components whose dependencies are done run
+# concurrently on a process pool, `chunksize` components per task. Workers
+# re-parse declarations from `sources` (one text per decl), so ASTs are never
+# pickled; without sources, or with max_workers=1, inference runs in-process.
+# With a cache.InferenceCache, components whose key is cached are not
+# re-inferred. `env` gives the signatures of names defined outside the module,
+# e.g. an interface.Interface; only those referenced are read. As each
+# component is done, on_finish(names, types, error, seconds) is called with
+# its signatures or error and the time spent inferring it. Declarations
+# parsed with a hashcons.SubtreeTable are inferred in-process with the same
+# table as `subtrees`; workers parse their own unshared trees. Returns
+# (types, errors), both dicts keyed by declaration name.
+def infer_module(decls, sources=None, max_workers=None, chunksize=16,
+                 cache=None, env=None, solver="deferred", on_finish=None,
+                 subtrees=None):
+    if env is None:
+        env = {}
+    by_name = {decl.name: i for i, decl in enumerate(decls)}
+    graph = reference_graph(decls)
+    sccs = strongly_connected_components(graph)
+    external = {}
+    if env:
+        for decl in decls:
+            external[decl.name] = [name for name in sorted(free_names(decl.expr))
+                                   if name not in by_name and name in env]
+
+    scc_of = {}
+    for i, scc in enumerate(sccs):
+        for name in scc:
+            scc_of[name] = i
+    waiting = [set() for _ in sccs]
+    dependents = [set() for _ in sccs]
+    for i, scc in enumerate(sccs):
+        for name in scc:
+            for dep in graph[name]:
+                j = scc_of[dep]
+                if j != i:
+                    waiting[i].add(j)
+                    dependents[j].add(i)
+
+    types = {}
+    errors = {}
+
+    def task(i):
+        names = sccs[i]
+        deps = {dep: types[dep] for name in names for dep in graph[name]
+                if dep in types}
+        for name in names:
+            for dep in external.get(name, ()):
+                deps[dep] = env[dep]
+        return names, deps
+
+    keys = {}
+
+    def cached(i):
+        if cache is None:
+            return None
+        names, deps = task(i)
+        keys[i] = cache.key([decls[by_name[name]] for name in names], deps)
+        return cache.get(keys[i], names)
+
+    def store(i, result, error):
+        if cache is not None:
+            cache.put(keys[i], sccs[i], result, error)
+
+    # Records a finished component and returns the components it unblocks.
+    # Dependents of an ill-typed component fail without being inferred.
+    def finish(i, result, error, seconds=0.0):
+        ready = []
+        stack = [(i, result, error)]
+        while stack:
+            i, result, error = stack.pop()
+            if error is None:
+                types.update(result)
+            else:
+                for name in sccs[i]:
+                    errors[name] = error
+            if on_finish is not None:
+                on_finish(sccs[i], result, error, seconds)
+                seconds = 0.0
+            for j in dependents[i]:
+                waiting[j].discard(i)
+                if waiting[j]:
+                    continue
+                bad = [dep for name in sccs[j] for dep in graph[name] if dep in errors]
+                if bad:
+                    stack.append((j, None, f"depends on ill-typed declaration {bad[0]}"))
+                else:
+                    ready.append(j)
+        return ready
+
+    if cache is not None:
+        cache.begin_run()
+    ready = [i for i, w in enumerate(waiting) if not w]
+
+    if sources is None or max_workers == 1:
+        while ready:
+            i = ready.pop()
+            entry = cached(i)
+            if entry is not None:
+                ready.extend(finish(i, *entry))
+                continue
+            names, deps = task(i)
+            result, error, seconds = _infer_component(
+                [decls[by_name[name]] for name in names], deps, solver, subtrees)
+            store(i, result, error)
+            ready.extend(finish(i, result, error, seconds))
+        return types, errors
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers, initializer=_init_worker) as executor:
+        pending = {}
+        while ready or pending:
+            while ready:
+                chunk = []
+                while ready and len(chunk) < chunksize:
+                    i = ready.pop()
+                    entry = cached(i)
+                    if entry is not None:
+                        ready.extend(finish(i, *entry))
+                    else:
+                        chunk.append(i)
+                if not chunk:
+                    continue
+                batch = []
+                for i in chunk:
+                    names, deps = task(i)
+                    batch.append(([sources[by_name[name]] for name in names], deps))
+                pending[executor.submit(_infer_chunk, batch, solver)] = chunk
+            if not pending:
+                break
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                chunk = pending.pop(future)
+                for i, (result, error, seconds) in zip(chunk, future.result()):
+                    store(i, result, error)
+                    ready.extend(finish(i, result, error, seconds))
+    return types, errors
+
+
+def infer_module_source(text, max_workers=None, chunksize=16, cache=None, env=None):
+    spans = []
+    decls = parser.Parser().parse_module(text, spans)
+    sources = [text[start:end] for start, end in spans]
+    return infer_module(decls, sources, max_workers, chunksize, cache, env)
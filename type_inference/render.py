@@ -0,0 +1,48 @@
+ELLIPSIS = "..."
+
+
+# Renders a tree of AST nodes or type terms in one pass into a single buffer.
+# Each non-string item has a _parts() method giving its rendering as a
+# sequence of strings and sub-items; they are expanded from an explicit
+# stack, so the time is linear in the output and deep trees do not hit the
+# recursion limit. Items nested deeper than `max_depth` are written as
+# "...", and output past `max_width` characters is cut, ending in "...";
+# rendering stops there, so a truncated item costs only what is written.
+def to_string(root, max_depth=None, max_width=None):
+    out = []
+    if max_depth is None and max_width is None:
+        stack = [root]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                out.append(item)
+            else:
+                stack.extend(reversed(item._parts()))
+        return "".join(out)
+
+    width = 0
+    stack = [(root, 0)]
+    while stack:
+        item, depth = stack.pop()
+        if isinstance(item, str):
+            piece = item
+        elif max_depth is not None and depth > max_depth:
+            piece = ELLIPSIS
+        else:
+            stack.extend((part, depth + 1) for part in reversed(item._parts()))
+            continue
+        out.append(piece)
+        width += len(piece)
+        if max_width is not None and width > max_width:
+            return "".join(out)[:max(0, max_width - len(ELLIPSIS))] + ELLIPSIS
+    return "".join(out)
+
+
+# `items` with `sep` between them, for building _parts().
+def joined(items, sep=", "):
+    parts = []
+    for item in items:
+        if parts:
+            parts.append(sep)
+        parts.append(item)
+    return parts
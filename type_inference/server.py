@@ -0,0 +1,222 @@
+import asyncio
+import concurrent.futures
+import functools
+import json
+import sys
+
+import module
+import parser
+import typing
+
+# Longest request line accepted, in bytes.
+LINE_LIMIT = 64 * 1024 * 1024
+
+
+# A long-running inference service speaking JSON lines. Each request is an
+# object with an "id" and a "method":
+#   {"id": 1, "method": "infer", "source": "f x = x + 1"}
+#       -> {"id": 1, "name": "f", "type": "(Int -> Int)"} or {"id": 1, "error": ...}
+#   {"id": 2, "method": "module", "source": "..."}
+#       -> {"id": 2, "types": {name: type}, "errors": {name: message}}
+#   {"id": 3, "method": "cancel", "target": 1}
+#       -> {"id": 3, "cancelled": 1, "found": true}, and the target answers
+#          {"id": 1, "cancelled": true} unless already done; "found" is false
+#          for a target that is unknown or has already answered
+#   {"id": 4, "method": "stats"}
+#       -> {"id": 4, "parse": [hits, misses, size], "infer": [...], "module": [...]}
+# Requests are pipelined: a client may send many without waiting, and answers
+# come back as they finish, matched by id. Every request gets an answer; one
+# that is malformed, or whose id is still in flight, is answered with an
+# error. Work runs in order on one thread that owns a warm parser; parsed
+# declarations and results are kept in LRU caches keyed by source text, so a
+# repeated request is answered from memory.
+class InferenceServer:
+    def __init__(self, cache_size=1024):
+        self.parser = parser.Parser()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.pending = set()
+        self.parse = functools.lru_cache(maxsize=cache_size)(self._parse)
+        self.infer = functools.lru_cache(maxsize=cache_size)(self._infer)
+        self.infer_module = functools.lru_cache(maxsize=cache_size)(self._infer_module)
+
+    def _parse(self, source):
+        return self.parser.parse_decl(source)
+
+    def _infer(self, source):
+        try:
+            decl = self.parse(source)
+            typ = typing.infer_decls([decl])[decl.name]
+        except (parser.ParseError, typing.TypingError) as e:
+            return {"error": str(e)}
+        return {"name": decl.name, "type": str(typ)}
+
+    def _infer_module(self, source):
+        try:
+            types, errors = module.infer_module(self.parser.parse_module(source),
+                                                max_workers=1)
+        except (parser.ParseError, typing.TypingError) as e:
+            return {"error": str(e)}
+        return {"types": {name: str(typ) for name, typ in types.items()},
+                "errors": errors}
+
+    # Runs on the worker thread.
+    def dispatch(self, request):
+        method = request.get("method")
+        if method == "infer":
+            return self.infer(_source(request))
+        elif method == "module":
+            return self.infer_module(_source(request))
+        elif method == "stats":
+            stats = {}
+            for name, cache in (("parse", self.parse), ("infer", self.infer),
+                                ("module", self.infer_module)):
+                info = cache.cache_info()
+                stats[name] = [info.hits, info.misses, info.currsize]
+            return stats
+        raise ValueError(f"unknown method {method}")
+
+    # Serves requests read from `reader` (an asyncio.StreamReader) until end
+    # of input, passing each answer to `write` as a dict.
+    async def serve(self, reader, write):
+        loop = asyncio.get_running_loop()
+        tasks = {}
+
+        async def run(request):
+            future = self.executor.submit(self.dispatch, request)
+            self.pending.add(future)
+            future.add_done_callback(self.pending.discard)
+            try:
+                answer = await asyncio.wrap_future(future, loop=loop)
+            except (KeyError, ValueError) as e:
+                answer = {"error": f"bad request: {e}"}
+            except Exception as e:
+                answer = {"error": f"internal error: {type(e).__name__}: {e}"}
+            write({"id": request.get("id"), **answer})
+
+        # A request cancelled while queued never runs; one cancelled while
+        # running finishes on the worker, and its result is only cached.
+        def finished(rid, task):
+            tasks.pop(rid, None)
+            if task.cancelled():
+                write({"id": rid, "cancelled": True})
+
+        while True:
+            line = await _readline(reader)
+            if line is None:
+                write({"id": None, "error": "bad request: line too long"})
+                continue
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                write({"id": None, "error": f"bad request: {e}"})
+                continue
+            if not isinstance(request, dict):
+                write({"id": None, "error": "bad request: not a JSON object"})
+                continue
+            rid = request.get("id")
+            if not isinstance(rid, _ID_TYPES):
+                write({"id": None, "error": "bad request: id must be a string or a number"})
+                continue
+            if request.get("method") == "cancel":
+                target = request.get("target")
+                if not isinstance(target, _ID_TYPES):
+                    write({"id": rid, "error": "bad request: target must be a string or a number"})
+                    continue
+                task = tasks.get(target)
+                found = task is not None and not task.done()
+                if found:
+                    task.cancel()
+                write({"id": rid, "cancelled": target, "found": found})
+                continue
+            if rid in tasks:
+                write({"id": rid, "error": f"bad request: id {rid!r} is already in flight"})
+                continue
+            tasks[rid] = asyncio.ensure_future(run(request))
+            tasks[rid].add_done_callback(functools.partial(finished, rid))
+        if tasks:
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+    # Drops queued requests; one already running finishes on the worker.
+    def close(self):
+        for future in list(self.pending):
+            future.cancel()
+        self.executor.shutdown(wait=False)
+
+
+_ID_TYPES = (str, int, float, type(None))
+
+
+def _source(request):
+    source = request["source"]
+    if not isinstance(source, str):
+        raise ValueError("source must be a string")
+    return source
+
+
+# Reads one line, or b"" at end of input. A line longer than the reader's
+# limit is skipped up to its newline, and None returned in its place.
+async def _readline(reader):
+    try:
+        return await reader.readuntil(b"\n")
+    except asyncio.IncompleteReadError as e:
+        return e.partial
+    except asyncio.LimitOverrunError as e:
+        consumed = e.consumed
+    while True:
+        await reader.readexactly(consumed)
+        try:
+            await reader.readuntil(b"\n")
+            return None
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError as e:
+            consumed = e.consumed
+
+
+def _line_writer(write, flush):
+    def send(answer):
+        write(json.dumps(answer) + "\n")
+        flush()
+    return send
+
+
+async def serve_stdio(server):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=LINE_LIMIT)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    await server.serve(reader, _line_writer(sys.stdout.write, sys.stdout.flush))
+
+
+async def serve_unix(server, path):
+    async def client(reader, writer):
+        try:
+            await server.serve(reader, _line_writer(
+                lambda line: writer.write(line.encode()), lambda: None))
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async with await asyncio.start_unix_server(client, path, limit=LINE_LIMIT) as unix_server:
+        await unix_server.serve_forever()
+
+
+def add_arguments(argparser):
+    argparser.add_argument("--socket", help="listen on this Unix socket instead of stdin/stdout")
+    argparser.add_argument("--cache-size", type=int, default=1024,
+                           help="entries kept in each LRU cache")
+
+
+def main(args):
+    server = InferenceServer(args.cache_size)
+    try:
+        if args.socket:
+            asyncio.run(serve_unix(server, args.socket))
+        else:
+            asyncio.run(serve_stdio(server))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
@@ -1,269 +1,1281 @@
-import itertools
+import contextlib
+import hashlib
+import threading
+import time
+import weakref
 
 import ast
+import environment
+import render
+
+
+# Type terms are interned and immutable: Int and Bool are singletons,
+# FuncType and TypeVar are hash-consed, so structural equality is identity
+# and hashes are computed once at construction. Types render through
+# render.to_string() like AST nodes. A miss in an intern table is filled
+# under _intern_lock, so threads building the same term get the same object.
+_intern_lock = threading.Lock()
 
 
 class Type:
-    pass
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    __delattr__ = __setattr__
 
 
 class IntType(Type):
+    __slots__ = ("__weakref__",)
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            type.__setattr__(cls, "_instance", object.__new__(cls))
+        return cls._instance
+
+    def __reduce__(self):
+        return (IntType, ())
+
     def __str__(self):
         return "Int"
 
     __repr__ = __str__
 
-    def __eq__(self, other):
-        return type(self) == type(other)
-
+    def _parts(self):
+        return ("Int",)
 
 
 class BoolType(Type):
+    __slots__ = ("__weakref__",)
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            type.__setattr__(cls, "_instance", object.__new__(cls))
+        return cls._instance
+
+    def __reduce__(self):
+        return (BoolType, ())
+
     def __str__(self):
         return "Bool"
 
     __repr__ = __str__
 
-    def __eq__(self, other):
-        return type(self) == type(other)
+    def _parts(self):
+        return ("Bool",)
 
 
 class FuncType(Type):
-    def __init__(self, argtypes, rettype):
+    __slots__ = ("argtypes", "rettype", "_hash", "__weakref__")
+    _table = weakref.WeakValueDictionary()
+
+    def __new__(cls, argtypes, rettype):
+        argtypes = tuple(argtypes)
         assert len(argtypes) > 0
-        self.argtypes = argtypes
-        self.rettype = rettype
+        key = (argtypes, rettype)
+        self = cls._table.get(key)
+        if self is None:
+            with _intern_lock:
+                self = cls._table.get(key)
+                if self is None:
+                    self = object.__new__(cls)
+                    object.__setattr__(self, "argtypes", argtypes)
+                    object.__setattr__(self, "rettype", rettype)
+                    object.__setattr__(self, "_hash", hash(key))
+                    cls._table[key] = self
+        return self
+
+    def __reduce__(self):
+        return (FuncType, (self.argtypes, self.rettype))
+
+    def __hash__(self):
+        return self._hash
 
     def __str__(self):
-        if len(self.argtypes) == 1:
-            return '({} -> {})'.format(self.argtypes[0], self.rettype)
-        else:
-            return '(({}) -> {})'.format(', '.join(map(str, self.argtypes)),
-                                         self.rettype)
+        return render.to_string(self)
 
     __repr__ = __str__
 
-    def __eq__(self, other):
-        return (type(self) == type(other)
-                and self.rettype == other.rettype
-                and all(self.argtypes[i] == other.argtypes[i] for i in range(len(self.argtypes))))
+    def _parts(self):
+        if len(self.argtypes) == 1:
+            return ("(", self.argtypes[0], " -> ", self.rettype, ")")
+        return ("((", *render.joined(self.argtypes), ") -> ", self.rettype, ")")
 
 
 class TypeVar(Type):
-    def __init__(self, name):
-        self.name = name
+    __slots__ = ("id", "name", "_hash", "__weakref__")
+    _table = weakref.WeakValueDictionary()
+
+    def __new__(cls, id, name=None):
+        key = (id, name)
+        self = cls._table.get(key)
+        if self is None:
+            with _intern_lock:
+                self = cls._table.get(key)
+                if self is None:
+                    self = object.__new__(cls)
+                    object.__setattr__(self, "id", id)
+                    object.__setattr__(self, "name", f"t{id}" if name is None else name)
+                    object.__setattr__(self, "_hash", hash(key))
+                    cls._table[key] = self
+        return self
+
+    def __reduce__(self):
+        name = None if self.name == f"t{self.id}" else self.name
+        return (TypeVar, (self.id, name))
+
+    def __hash__(self):
+        return self._hash
 
     def __str__(self):
         return self.name
 
     __repr__ = __str__
 
-    def __eq__(self, other):
-        return type(self) == type(other)
+    def _parts(self):
+        return (self.name,)
+
+
+# A polymorphic signature: `typ` with the variables in `quantified` bound.
+class TypeScheme:
+    __slots__ = ("quantified", "typ")
+
+    def __init__(self, quantified, typ):
+        self.quantified = tuple(quantified)
+        self.typ = typ
+
+    def __str__(self):
+        return render.to_string(self)
+
+    __repr__ = __str__
+
+    def _parts(self):
+        if not self.quantified:
+            return (self.typ,)
+        return (f"forall {' '.join(map(str, self.quantified))}. ", self.typ)
 
 
 class TypingError(Exception):
     pass
 
-_typecounter = itertools.count(start=0)
+# Counters and phase timers of inference runs. Counters are added to once
+# per call of the instrumented functions (loops count into locals), so
+# keeping them costs next to nothing; phase() times a block and passes the
+# span to each hook as hook(phase, start, end), perf_counter() seconds.
+class Stats:
+    def __init__(self, hooks=()):
+        self.counters = {}
+        self.timers = {}
+        self.hooks = list(hooks)
 
+    def __getitem__(self, name):
+        return self.counters.get(name, 0)
 
-def _get_fresh_typename():
-    return f"{next(_typecounter)}"
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
 
+    def maximum(self, name, value):
+        if value > self.counters.get(name, 0):
+            self.counters[name] = value
 
-def reset_type_counter():
-    global _typecounter
-    _typecounter = itertools.count(start=0)
+    def count_nodes(self, node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            self.count(f"nodes.{type(node).__name__}")
+            stack.extend(node._children)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.timers[name] = self.timers.get(name, 0.0) + end - start
+            for hook in self.hooks:
+                hook(name, start, end)
+
+    def report(self):
+        lines = [f"{name:24} {seconds * 1000:10.3f} ms"
+                 for name, seconds in self.timers.items()]
+        lines.extend(f"{name:24} {value:10}"
+                     for name, value in sorted(self.counters.items()))
+        return "\n".join(lines)
+
+
+# Stats that keep nothing, the default of an InferenceContext given none, so
+# that counting costs only a no-op call when nobody reads the counters.
+class NullStats(Stats):
+    def count(self, name, n=1):
+        pass
+
+    def maximum(self, name, value):
+        pass
+
+    def count_nodes(self, node):
+        pass
+
+    def phase(self, name):
+        return contextlib.nullcontext()
 
-def assign_typenames(node, symtab={}):
-    if isinstance(node, ast.Identifier):
-        if node.name in symtab:
-            node._type = symtab[node.name]
+
+_no_stats = NullStats()
+
+
+# Everything one inference run mutates: the fresh-variable supply, the
+# let-levels of variables, the last substitution solved, and Stats (none
+# kept unless a Stats is given). Runs
+# with separate contexts share no state, so they may proceed concurrently,
+# and each numbers its variables from t0 regardless of what else is running.
+#
+# Fresh variables remember the let-level they were created at; unification
+# lowers the level of every variable a lower-level variable gets bound to, so
+# a variable may be generalised iff its level is above the current one.
+# Variables created at level 0 are not recorded.
+#
+# With `subtrees`, a hashcons.SubtreeTable the AST was parsed through, shared
+# closed subtrees get the principal type memoised in the table instead of
+# being inferred again.
+class InferenceContext:
+    def __init__(self, stats=None, subtrees=None):
+        self.next_id = 0
+        self.level = 0
+        self.levels = {}
+        self.subst = None
+        self.stats = _no_stats if stats is None else stats
+        self.subtrees = subtrees
+
+    def fresh_typevar(self):
+        v = TypeVar(self.next_id)
+        self.next_id += 1
+        if self.level:
+            self.levels[v] = self.level
+        return v
+
+    def typevar_level(self, v):
+        return self.levels.get(v, 0)
+
+    def set_level(self, v, level):
+        if level:
+            self.levels[v] = level
         else:
-            raise TypingError(f"unbounded name {node.name}")
+            self.levels.pop(v, None)
+
+    def enter_level(self):
+        self.level += 1
+
+    def leave_level(self):
+        self.level -= 1
+
+    def reset(self):
+        self.__init__(subtrees=self.subtrees)
+
+
+# Used by the functions below when no context is passed.
+_default_context = InferenceContext()
+
+
+def _get_fresh_typevar(ctx=None):
+    if ctx is None:
+        ctx = _default_context
+    ctx.stats.count("typevars")
+    return ctx.fresh_typevar()
 
-    elif isinstance(node, ast.LambdaExpr):
-        node._type = TypeVar(_get_fresh_typename())
-        local_symtab = {}
-        for argname in node.argnames:
-            typename = _get_fresh_typename()
-            local_symtab[argname] = TypeVar(typename)
-        node._arg_types = local_symtab
-        assign_typenames(node.expr, {**symtab, **local_symtab})
 
-    elif isinstance(node, ast.OpExpr) or isinstance(node, astIfExpr) or isinstance(node, ast.AppExpr):
-        node._type = TypeVar(_get_fresh_typename())
-        node.visit_children(lambda c: assign_typenames(c, symtab))
+def typevar_level(v):
+    return _default_context.typevar_level(v)
 
-    elif isinstance(node, ast.IntConstant):
-        node._type = IntType()
 
-    elif isinstance(node, ast.BoolConstant):
-        node._type = BoolType()
+def enter_level():
+    _default_context.enter_level()
 
+
+def leave_level():
+    _default_context.leave_level()
+
+
+def reset_type_counter():
+    _default_context.reset()
+
+# Worklist marker for leaving a lambda's scope.
+_LEAVE_SCOPE = object()
+
+
+# Types assigned to the nodes of one inference run. They are kept beside the
+# AST rather than on it, so a parsed tree is never written to and can be
+# cached and inferred many times, also from several threads at once. Keyed
+# by node: ast objects hash by identity, store views by (store, node id).
+#   types       node -> its type variable or constant type
+#   arg_types   lambda node -> {argname: type variable}
+#   schemes     shared closed node -> its memoised principal type; its
+#               subtree is not annotated, and each use instantiates it afresh
+class Annotations:
+    __slots__ = ("types", "arg_types", "schemes")
+
+    def __init__(self):
+        self.types = {}
+        self.arg_types = {}
+        self.schemes = {}
+
+    def __getitem__(self, node):
+        typ = self.types.get(node)
+        if typ is None:
+            return self.schemes[node]
+        return typ
+
+    def __contains__(self, node):
+        return node in self.types
+
+    def __len__(self):
+        return len(self.types)
+
+
+# `symtab` may be a plain mapping, used as the global scope without copying,
+# or an environment.Environment. Types are recorded in `annotations`, a new
+# Annotations table unless one is given, which is returned. A subtree met
+# twice, as in a tree parsed with hashcons sharing, is an error unless `ctx`
+# has that SubtreeTable: annotating it twice would tie its uses together.
+def assign_typenames(node, symtab=None, annotations=None, ctx=None):
+    if ctx is None:
+        ctx = _default_context
+    if annotations is None:
+        annotations = Annotations()
+    types = annotations.types
+    if isinstance(symtab, environment.Environment):
+        env = symtab
     else:
-        raise TypingError(f"unknown node {type(node)}.")
+        env = environment.Environment(symtab)
+    depth = len(env.scopes)
+    closed = () if ctx.subtrees is None else ctx.subtrees.closed
+    root = node
+    stack = [node]
+    try:
+        while stack:
+            node = stack.pop()
+            if node is _LEAVE_SCOPE:
+                env.pop_scope()
 
+            elif node in closed and node._children and node is not root:
+                annotations.schemes[node] = _principal_type(node, ctx)
 
-def show_type_assignment(node):
-    lines = []
-    def show_rec(node):
-        lines.append(f"{str(node):60} {node._type}")
-        node.visit_children(show_rec)
+            elif node._children and node in types:
+                raise TypingError(
+                    f"subtree {render.to_string(node, max_width=40)} is shared; a tree "
+                    f"parsed with share= is inferred with InferenceContext(subtrees=...)")
+
+            elif isinstance(node, ast.Identifier):
+                if node.name not in env:
+                    raise TypingError(f"unbounded name {node.name}")
+                typ = env[node.name]
+                if isinstance(typ, TypeScheme):
+                    types[node] = instantiate(typ, ctx)
+                else:
+                    types[node] = typ
+
+            elif isinstance(node, ast.LambdaExpr):
+                types[node] = _get_fresh_typevar(ctx)
+                local_symtab = {}
+                for argname in node.argnames:
+                    local_symtab[argname] = _get_fresh_typevar(ctx)
+                annotations.arg_types[node] = local_symtab
+                env.push_scope(local_symtab)
+                stack.append(_LEAVE_SCOPE)
+                stack.append(node.expr)
+
+            elif isinstance(node, ast.OpExpr) or isinstance(node, ast.IfExpr) or isinstance(node, ast.AppExpr):
+                types[node] = _get_fresh_typevar(ctx)
+                stack.extend(reversed(node._children))
+
+            elif isinstance(node, ast.IntConstant):
+                types[node] = IntType()
+
+            elif isinstance(node, ast.BoolConstant):
+                types[node] = BoolType()
+
+            else:
+                raise TypingError(f"unknown node {type(node)}.")
+    finally:
+        env.unwind(depth)
+    return annotations
+
+
+# Nodes in `stop` below the root are yielded but not descended into.
+def _preorder(node, stop=()):
+    yield node
+    stack = list(reversed(node._children))
+    while stack:
+        node = stack.pop()
+        yield node
+        if not stop or node not in stop:
+            stack.extend(reversed(node._children))
+
+
+# Nodes in `stop` below the root are skipped along with their subtrees.
+def _postorder(node, stop=()):
+    stack = [(node, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded or not node._children:
+            yield node
+        else:
+            stack.append((node, True))
+            children = node._children
+            if stop:
+                children = [c for c in children if c not in stop]
+            stack.extend((c, False) for c in reversed(children))
 
-    show_rec(node)
+
+# Principal type scheme of a shared closed subtree, inferred once per
+# hashcons.SubtreeTable in a context of its own; the subtree has no free
+# names, so its type does not depend on where it occurs. Shared subtrees
+# below it without a type yet are inferred first, bottom-up, so each
+# inference stops at the shared subtrees inside it and none recurses.
+def _principal_type(node, ctx):
+    table = ctx.subtrees
+    table.lookups += 1
+    scheme = table.types.get(node)
+    if scheme is not None:
+        return scheme
+    for sub in _postorder(node, table.types):
+        if sub in table.types or sub not in table.closed or not sub._children:
+            continue
+        sub_ctx = InferenceContext(ctx.stats, table)
+        annotations = assign_typenames(sub, ctx=sub_ctx)
+        subst, conflict = unify_stream(iter_equations(sub, annotations, sub_ctx),
+                                       "deferred", sub_ctx)
+        if conflict is not None:
+            raise TypingError(f"cannot unify {conflict}")
+        table.types[sub] = close_over(canonical_type(apply_unifier(annotations[sub], subst)))
+        table.misses += 1
+    return table.types[node]
+
+
+def _schemes(types):
+    if isinstance(types, ResolvedTypes):
+        types = types.annotations
+    return types.schemes
+
+
+# `types` is an Annotations table, or ResolvedTypes for the solved types.
+# Each node is cut to `width` characters and each type to `type_width`, and
+# both to `max_depth` levels (see render.to_string), so the dump is linear in
+# the size of the tree.
+def show_type_assignment(node, types, width=60, type_width=80, max_depth=None):
+    lines = []
+    for node in _preorder(node, _schemes(types)):
+        lines.append(f"{render.to_string(node, max_depth, width):{width}} "
+                     f"{render.to_string(types[node], max_depth, type_width)}")
     return "\n".join(lines)
 
 class TypeEquation:
+    __slots__ = ("left", "right", "orig_node")
+
     def __init__(self, left, right, orig_node):
         self.left = left
         self.right = right
         self.orig_node = orig_node
 
     def __str__(self):
-        return f"{self.left} :: {self.right} [from {self.orig_node}]"
+        return (f"{self.left} :: {self.right} "
+                f"[from {render.to_string(self.orig_node, max_width=60)}]")
 
     __repr__ = __str__
 
-def generate_equations(node, type_equations):
-    if isinstance(node, ast.IntConstant):
-        type_equations.append(TypeEquation(node._type, IntType(), node))
+# Nodes with a memoised scheme (see Annotations) are not descended into; each
+# use of one gets a fresh instance of its scheme, made in `ctx`.
+def iter_equations(node, annotations, ctx=None):
+    types = annotations.types
+    schemes = annotations.schemes
+    if schemes:
+        def typeof(child):
+            scheme = schemes.get(child)
+            if scheme is None:
+                return types[child]
+            return instantiate(scheme, ctx)
+    else:
+        typeof = types.__getitem__
+    for node in _postorder(node, schemes):
+        if isinstance(node, ast.IntConstant):
+            yield TypeEquation(types[node], IntType(), node)
 
-    elif isinstance(node, ast.BoolConstant):
-        type_equations.append(TypeEquation(node._type, BoolType(), node))
+        elif isinstance(node, ast.BoolConstant):
+            yield TypeEquation(types[node], BoolType(), node)
 
-    elif isinstance(node, ast.Identifier):
-        pass
+        elif isinstance(node, ast.Identifier):
+            pass
+
+        elif isinstance(node, ast.OpExpr):
+            yield TypeEquation(typeof(node.left), IntType(), node)
+            yield TypeEquation(typeof(node.right), IntType(), node)
+            if node.op in ("==", "!=", "<", "<=", ">", ">="):
+                yield TypeEquation(types[node], BoolType(), node)
+            else:
+                yield TypeEquation(types[node], IntType(), node)
+
+        elif isinstance(node, ast.AppExpr):
+            argtypes = [typeof(arg) for arg in node.args]
+            yield TypeEquation(typeof(node.func),
+                               FuncType(argtypes, types[node]),
+                               node)
+
+        elif isinstance(node, ast.IfExpr):
+            yield TypeEquation(typeof(node.ifexpr), BoolType(), node)
+            yield TypeEquation(types[node], typeof(node.thenexpr), node)
+            yield TypeEquation(types[node], typeof(node.elseexpr), node)
+
+        elif isinstance(node, ast.LambdaExpr):
+            argtypes = [annotations.arg_types[node][name] for name in node.argnames]
+            yield TypeEquation(types[node],
+                               FuncType(argtypes, typeof(node.expr)), node)
 
-    elif isinstance(node, ast.OpExpr):
-        node.visit_children(lambda c: generate_equations(c, type_equations))
-        type_equations.append(TypeEquation(node.left._type, IntType(), node))
-        type_equations.append(TypeEquation(node.right._type, InType(), node))
-        if node.op in ("==", "!=", "<", "<=", ">", ">="):
-            type_equations.append(TypeEquation(node._type, BoolType(), node))
         else:
-            type_equations.append(TypeEquation(node._type, IntType(), node))
-
-    elif isinstance(node, ast.AppExpr):
-        node.visit_children(lambda c: generate_equations(c, type_equations))
-        argtypes = [arg._type for arg in node.args]
-        type_equations.append(TypeEquation(node.func._type,
-                                           FuncType(argstypes, node._type),
-                                           node))
-
-    elif isinstance(node, ast.IfExpr):
-        node.visit_children(lambda c: generate_equations(c, type_equations))
-        type_equations.append(TypeEquation(node.ifexpr._type, BoolType(), node))
-        type_equations.append(TypeEquation(node._type, node.thenexpr._type, node))
-        type_equations.append(TypeEquation(node._type, node.elseexpr._type, node))
-
-    elif isinstance(node, ast.LabmdaExpr):
-        node.visit_children(lambda c: generate_equations(c, type_equations))
-        argtypes = [node._arg_types[name] for name in node.argnames]
-        type_equations.append(
-            TypeEquation(node._type,
-                         FuncType(argtypes, node.expr._type), node))
+            raise TypingError(f"unknown node {type(node)}")
 
-    else:
-        raise TypingError(f"unknown node {type(node)}")
 
-def unify(typ_x, typ_y, subst):
-    if subst is None:
-        return subst
+def generate_equations(node, annotations, type_equations, ctx=None):
+    type_equations.extend(iter_equations(node, annotations, ctx))
 
-    elif typ_x == typ_y:
-        return subst
 
-    elif isinstance(typ_x, TypeVar):
-        return unify_variable(typ_x, typ_y, subst)
+def _is_ground(typ):
+    return next(typevars(typ), None) is None
 
-    elif isinstance(typ_y, TypeVar):
-        return unify_variable(typ_y, typ_x, subst)
 
-    elif isinstance(typ_x, FuncType) and isinstance(typ_y, FuncType):
-        if len(typ_x.argtypes) != len(typ_y.argtypes):
-            return None
+# Optional pass between generating and solving equations; the result has the
+# same solution. Tautologies and duplicates are dropped, and chains of
+# variable-to-variable aliases are collapsed onto one representative per
+# class, which the other equations are rewritten to use. Equations with a
+# ground side come first, so constant clashes are found early, and each
+# aliased variable is bound to its representative by one final equation.
+# Counts the equations removed in stats as "equations_removed".
+def simplify_equations(eqs, stats=None):
+    parent = {}
+    origin = {}
+
+    def find(v):
+        root = v
+        while root in parent:
+            root = parent[root]
+        while v is not root:
+            parent[v], v = root, parent[v]
+        return root
+
+    total = 0
+    others = []
+    for eq in eqs:
+        total += 1
+        if isinstance(eq.left, TypeVar) and isinstance(eq.right, TypeVar):
+            x, y = find(eq.left), find(eq.right)
+            if x is not y:
+                parent[x] = y
+                origin[x] = eq
         else:
-            subst = unify(typ_x.rettype, typ_y.rettype, subst)
-            for i in range(len(typ_x.argtypes)):
-                subst = unify(typ_x.argtypes[i], typ_y.argstypes[i], subst)
-            return subst
-    else:
-        return None
+            others.append(eq)
+
+    reps = {v: find(v) for v in parent}
+    done = {}
+    seen = set()
+    ground = []
+    rest = []
+    for eq in others:
+        left, right = eq.left, eq.right
+        if reps:
+            left = _resolve(left, reps, done)
+            right = _resolve(right, reps, done)
+        if left is right or (left, right) in seen or (right, left) in seen:
+            continue
+        seen.add((left, right))
+        if left is not eq.left or right is not eq.right:
+            eq = TypeEquation(left, right, eq.orig_node)
+        if _is_ground(left) or _is_ground(right):
+            ground.append(eq)
+        else:
+            rest.append(eq)
+
+    aliases = [TypeEquation(v, rep, origin[v].orig_node) for v, rep in reps.items()]
+    simplified = ground + rest + aliases
+    if stats is not None:
+        stats.count("equations_removed", total - len(simplified))
+    return simplified
 
-def occurs_check(v, typ, subst):
+
+def unify(typ_x, typ_y, subst, ctx=None):
+    if ctx is None:
+        ctx = _default_context
+    steps = 0
+    variables = 0
+    stack = [(typ_x, typ_y)]
+    while stack and subst is not None:
+        typ_x, typ_y = stack.pop()
+        steps += 1
+        if typ_x is typ_y:
+            continue
+
+        elif isinstance(typ_x, TypeVar) or isinstance(typ_y, TypeVar):
+            variables += 1
+            if isinstance(typ_x, TypeVar):
+                v, typ = typ_x, typ_y
+            else:
+                v, typ = typ_y, typ_x
+            if v in subst:
+                stack.append((subst[v], typ))
+            elif isinstance(typ, TypeVar) and typ in subst:
+                stack.append((v, subst[typ]))
+            elif occurs_check(v, typ, subst, ctx):
+                subst = None
+            else:
+                _adjust_levels(ctx.typevar_level(v), typ, subst, ctx)
+                subst = {**subst, v: typ}
+                ctx.stats.count("bindings")
+
+        elif isinstance(typ_x, FuncType) and isinstance(typ_y, FuncType):
+            if len(typ_x.argtypes) != len(typ_y.argtypes):
+                subst = None
+            else:
+                stack.extend(reversed(list(zip(typ_x.argtypes, typ_y.argtypes))))
+                stack.append((typ_x.rettype, typ_y.rettype))
+
+        else:
+            subst = None
+    ctx.stats.count("unify_calls")
+    ctx.stats.count("unify_steps", steps)
+    ctx.stats.count("unify_variable_calls", variables)
+    return subst
+
+
+def occurs_check(v, typ, subst, ctx=None):
     assert(isinstance(v, TypeVar))
-    if v == typ:
-        return True
-    elif isinstance(typ, TypeVar) and typ.name in subst:
-        return occurs_check(v, subst[typ.name], subst)
-    elif isinstance(type, FuncType):
-        return (occurs_check(v, typ.rettype, subst)
-                or any(occurs_check(v, arg, subst) for arg in typ.argtypes))
-    else:
-        return False
+    steps = 0
+    found = False
+    stack = [typ]
+    seen = set()
+    while stack:
+        typ = stack.pop()
+        steps += 1
+        if v is typ:
+            found = True
+            break
+        elif isinstance(typ, TypeVar) and typ in subst:
+            stack.append(subst[typ])
+        elif isinstance(typ, FuncType) and typ not in seen:
+            seen.add(typ)
+            stack.extend(reversed(typ.argtypes))
+            stack.append(typ.rettype)
+    if ctx is not None:
+        ctx.stats.count("occurs_steps", steps)
+    return found
+
+
+def _adjust_levels(level, typ, subst, ctx):
+    for t in typevars(apply_unifier(typ, subst)):
+        if ctx.typevar_level(t) > level:
+            ctx.set_level(t, level)
+
 
-def unify_variable(v, typ, subst):
+def unify_variable(v, typ, subst, ctx=None):
     assert(isinstance(v, TypeVar))
-    if v.name in subst:
-        return unify(subst[v.name], typ, subst)
+    if ctx is None:
+        ctx = _default_context
+    ctx.stats.count("unify_variable_calls")
+    if v in subst:
+        return unify(subst[v], typ, subst, ctx)
 
-    elif isinstance(typ, TypeVar) and typ.name in subst:
-        return unify(v, subst[typ.name], subst)
+    elif isinstance(typ, TypeVar) and typ in subst:
+        return unify(v, subst[typ], subst, ctx)
 
-    elif occurs_check(v, typ, subst):
+    elif occurs_check(v, typ, subst, ctx):
         return None
 
     else:
-        return {**subst, v.name: typ}
+        return {**subst, v: typ}
 
-def unify_all_equations(eqs):
-    subst = {}
-    for eq in eqs:
-        subst = unify(eq.left, eq.right, subst)
-        if subst is None:
-            break
+# Type variables are merged in place with union by rank and path compression;
+# a class root may be bound to a non-variable type. Reads like the dict
+# substitution (``in``, ``[]``, ``len``) so apply_unifier works on either.
+#
+# With `deferred`, bindings skip the occurs check, so long chains of
+# variables no longer cost a walk of the bound type each. Classes are merged
+# before their bindings are compared, which keeps unification finite on
+# cyclic terms; cycles are then found by find_cycle() in one pass over the
+# bindings, and levels are lowered by lower_levels() once solving is done.
+class UnionFindSubst:
+    def __init__(self, ctx=None, deferred=False):
+        self.ctx = _default_context if ctx is None else ctx
+        self.deferred = deferred
+        self.parent = {}
+        self.rank = {}
+        self.binding = {}
+        self.steps = 0
+        self.occurs_steps = 0
+        self.variable_steps = 0
+        # Deferred mode: the equation being solved, if the caller sets one,
+        # and for each class root the (call number, equation) of the last
+        # unify call that bound it or merged it.
+        self.current = None
+        self.calls = 0
+        self.changed_by = {}
+
+    def find(self, v):
+        parent = self.parent
+        root = v
+        while root in parent:
+            root = parent[root]
+        while v is not root:
+            parent[v], v = root, parent[v]
+        return root
+
+    def resolve(self, typ):
+        if isinstance(typ, TypeVar):
+            root = self.find(typ)
+            return self.binding.get(root, root)
+        return typ
+
+    def union(self, x, y):
+        if self.rank.get(x, 0) < self.rank.get(y, 0):
+            x, y = y, x
+        self.parent[y] = x
+        if self.rank.get(x, 0) == self.rank.get(y, 0):
+            self.rank[x] = self.rank.get(x, 0) + 1
+        self.ctx.set_level(x, min(self.ctx.typevar_level(x), self.ctx.typevar_level(y)))
+
+    # Also lowers the level of the free variables of `typ` to that of `v`.
+    def occurs(self, v, typ):
+        root = self.find(v)
+        ctx = self.ctx
+        level = ctx.typevar_level(root)
+        steps = 0
+        found = False
+        stack = [typ]
+        seen = set()
+        while stack:
+            t = self.resolve(stack.pop())
+            steps += 1
+            if t is root:
+                found = True
+                break
+            elif isinstance(t, TypeVar):
+                if ctx.typevar_level(t) > level:
+                    ctx.set_level(t, level)
+            elif isinstance(t, FuncType) and t not in seen:
+                seen.add(t)
+                stack.append(t.rettype)
+                stack.extend(t.argtypes)
+        self.occurs_steps += steps
+        return found
+
+    def bind(self, v, typ):
+        if self.occurs(v, typ):
+            return False
+        self.binding[self.find(v)] = typ
+        return True
+
+    def unify(self, typ_x, typ_y):
+        if self.deferred:
+            return self._unify_deferred(typ_x, typ_y)
+        steps = 0
+        variables = 0
+        ok = True
+        stack = [(typ_x, typ_y)]
+        while stack and ok:
+            x, y = stack.pop()
+            steps += 1
+            x = self.resolve(x)
+            y = self.resolve(y)
+            if x is y:
+                continue
+            elif isinstance(x, TypeVar) and isinstance(y, TypeVar):
+                variables += 1
+                self.union(x, y)
+            elif isinstance(x, TypeVar):
+                variables += 1
+                ok = self.bind(x, y)
+            elif isinstance(y, TypeVar):
+                variables += 1
+                ok = self.bind(y, x)
+            elif isinstance(x, FuncType) and isinstance(y, FuncType):
+                if len(x.argtypes) != len(y.argtypes):
+                    ok = False
+                else:
+                    stack.append((x.rettype, y.rettype))
+                    stack.extend(zip(x.argtypes, y.argtypes))
+            else:
+                ok = False
+        self.steps += steps
+        self.variable_steps += variables
+        return ok
+
+    def _unify_deferred(self, typ_x, typ_y):
+        self.calls += 1
+        eq = self.current
+        if eq is None:
+            eq = TypeEquation(typ_x, typ_y, None)
+        changed = (self.calls, eq)
+        binding = self.binding
+        steps = 0
+        variables = 0
+        ok = True
+        stack = [(typ_x, typ_y)]
+        while stack and ok:
+            x, y = stack.pop()
+            steps += 1
+            if isinstance(x, TypeVar):
+                x = self.find(x)
+            if isinstance(y, TypeVar):
+                y = self.find(y)
+            if x is y:
+                continue
+            elif isinstance(x, TypeVar) and isinstance(y, TypeVar):
+                variables += 1
+                bx = binding.pop(x, None)
+                by = binding.pop(y, None)
+                self.union(x, y)
+                root = self.find(x)
+                self.changed_by[root] = changed
+                if bx is None or by is None:
+                    if bx is not None or by is not None:
+                        binding[root] = by if bx is None else bx
+                else:
+                    binding[root] = bx
+                    stack.append((bx, by))
+            elif isinstance(x, TypeVar) or isinstance(y, TypeVar):
+                variables += 1
+                if isinstance(y, TypeVar):
+                    x, y = y, x
+                if x in binding:
+                    stack.append((binding[x], y))
+                else:
+                    binding[x] = y
+                    self.changed_by[x] = changed
+            elif isinstance(x, FuncType) and isinstance(y, FuncType):
+                if len(x.argtypes) != len(y.argtypes):
+                    ok = False
+                else:
+                    stack.append((x.rettype, y.rettype))
+                    stack.extend(zip(x.argtypes, y.argtypes))
+            else:
+                ok = False
+        self.steps += steps
+        self.variable_steps += variables
+        return ok
+
+    # Bound class roots directly below `t`, a binding or a part of one.
+    def _bound_roots(self, t):
+        stack = [t]
+        while stack:
+            t = stack.pop()
+            if isinstance(t, TypeVar):
+                root = self.find(t)
+                if root in self.binding:
+                    yield root
+            elif isinstance(t, FuncType):
+                stack.append(t.rettype)
+                stack.extend(t.argtypes)
+
+    # Deferred mode: looks for a class whose binding reaches itself, i.e. an
+    # infinite type, by depth-first search over bound roots; each binding is
+    # walked once. Returns the equation that last changed a class on the
+    # cycle (the unified pair if no equation was set), or None.
+    def find_cycle(self):
+        done = set()
+        for start in list(self.binding):
+            if start in done:
+                continue
+            path = [start]
+            on_path = {start}
+            work = [self._bound_roots(self.binding[start])]
+            while work:
+                for root in work[-1]:
+                    if root in on_path:
+                        cycle = path[path.index(root):]
+                        last = max(cycle, key=lambda r: self.changed_by[r][0])
+                        return self.changed_by[last][1]
+                    if root not in done:
+                        path.append(root)
+                        on_path.add(root)
+                        work.append(self._bound_roots(self.binding[root]))
+                        break
+                else:
+                    work.pop()
+                    root = path.pop()
+                    on_path.discard(root)
+                    done.add(root)
+        return None
+
+    # Deferred mode: gives every variable reachable from a binding at most
+    # the level of the bound class, which eager mode does in occurs().
+    # Roots are visited lowest level first, so a walk stops at variables and
+    # function types already seen at that level or lower.
+    def lower_levels(self):
+        ctx = self.ctx
+        lowest = {}
+        for root in sorted(self.binding, key=ctx.typevar_level):
+            level = ctx.typevar_level(root)
+            stack = [self.binding[root]]
+            while stack:
+                t = stack.pop()
+                if isinstance(t, TypeVar):
+                    t = self.find(t)
+                    if ctx.typevar_level(t) > level:
+                        ctx.set_level(t, level)
+                        if t in self.binding:
+                            stack.append(self.binding[t])
+                elif isinstance(t, FuncType) and lowest.get(t, level + 1) > level:
+                    lowest[t] = level
+                    stack.append(t.rettype)
+                    stack.extend(t.argtypes)
+
+    # Adds the work done by this substitution to `stats` once solving is
+    # over; counting into attributes keeps the per-equation cost low.
+    def record(self, stats):
+        stats.count("unify_steps", self.steps)
+        stats.count("occurs_steps", self.occurs_steps)
+        stats.count("unify_variable_calls", self.variable_steps)
+        stats.count("unions", len(self.parent))
+        stats.count("bindings", len(self.binding))
+
+    def __contains__(self, v):
+        return v in self.binding or self.find(v) is not v
+
+    def __getitem__(self, v):
+        root = self.find(v)
+        if root in self.binding:
+            return self.binding[root]
+        elif root is not v:
+            return root
+        raise KeyError(v)
+
+    def __len__(self):
+        return len(self.parent) + len(self.binding)
+
+    def __iter__(self):
+        return iter(set(self.parent) | set(self.binding))
+
+    def __str__(self):
+        return str({v: self[v] for v in self})
+
+    __repr__ = __str__
+
+
+# "unionfind" checks occurs on every binding and so stops at the exact
+# equation that makes a type infinite; "deferred" checks once after solving,
+# in linear time, and blames an equation on the cycle.
+SOLVERS = ("unionfind", "deferred", "dict")
+
+
+# Solves equations as they are pulled from `eqs`, which may be a lazy
+# iterator such as iter_equations(): nothing but the substitution is kept
+# alive, and solving stops at the first conflicting equation. Returns the
+# substitution, also left in ctx.subst, and the conflicting equation (or None).
+# After a conflict the substitution may be cyclic and must not be applied.
+def unify_stream(eqs, solver="unionfind", ctx=None):
+    if ctx is None:
+        ctx = _default_context
+    conflict = None
+    count = 0
+    if solver == "unionfind" or solver == "deferred":
+        subst = UnionFindSubst(ctx, deferred=solver == "deferred")
+        for eq in eqs:
+            count += 1
+            subst.current = eq
+            if not subst.unify(eq.left, eq.right):
+                conflict = eq
+                break
+        if subst.deferred and conflict is None:
+            conflict = subst.find_cycle()
+            if conflict is None:
+                subst.lower_levels()
+        subst.record(ctx.stats)
+        ctx.stats.count("unify_calls", count)
+
+    elif solver == "dict":
+        subst = {}
+        for eq in eqs:
+            count += 1
+            new_subst = unify(eq.left, eq.right, subst, ctx)
+            if new_subst is None:
+                conflict = eq
+                break
+            subst = new_subst
+
+    else:
+        raise ValueError(f"unknown solver {solver}")
+    ctx.stats.count("equations", count)
+    ctx.stats.maximum("subst_size", len(subst))
+    ctx.subst = subst
+    return subst, conflict
+
+
+def unify_all_equations(eqs, solver="unionfind", ctx=None):
+    subst, conflict = unify_stream(eqs, solver, ctx)
+    if conflict is not None:
+        return None
     return subst
 
-def apply_unifier(typ, subst):
+
+# With `stats`, records the deepest the work stack got as apply_unifier_depth.
+def apply_unifier(typ, subst, stats=None):
     if subst is None:
         return subst
     elif len(subst) == 0:
         return typ
-    elif isinstance(typ, (BoolType, IntType)):
-        return typ
-    elif isinstance(typ, TypeVar):
-        if typ.name in subst:
-            return apply_unifier(subst[typ.name], subst)
+    return _resolve(typ, subst, {}, stats)
+
+
+# Post-order rebuild with an explicit stack. `done` maps terms to their
+# resolved form; it is filled as a side effect, so passing the same dict to
+# several calls shares resolved subterms between them.
+def _resolve(typ, subst, done, stats=None):
+    stack = [typ]
+    depth = 1
+    while stack:
+        t = stack[-1]
+        if t in done:
+            stack.pop()
+        elif isinstance(t, TypeVar):
+            if t not in subst or subst[t] is t:
+                done[t] = t
+                stack.pop()
+            elif subst[t] in done:
+                done[t] = done[subst[t]]
+                stack.pop()
+            else:
+                stack.append(subst[t])
+                depth = max(depth, len(stack))
+        elif isinstance(t, FuncType):
+            pending = [arg for arg in (*t.argtypes, t.rettype) if arg not in done]
+            if pending:
+                stack.extend(pending)
+                depth = max(depth, len(stack))
+            else:
+                done[t] = FuncType([done[arg] for arg in t.argtypes],
+                                   done[t.rettype])
+                stack.pop()
+        elif isinstance(t, (BoolType, IntType)):
+            done[t] = t
+            stack.pop()
         else:
+            return None
+    if stats is not None:
+        stats.maximum("apply_unifier_depth", depth)
+    return done[typ]
+
+
+# Final types of the nodes of a solved tree, for queries such as editor
+# hovers. Resolved terms are memoised across queries, so resolving every node
+# costs time linear in the tree and the substitution together, and a repeated
+# query is a lookup. Indexable like Annotations, so show_type_assignment can
+# print either.
+class ResolvedTypes:
+    def __init__(self, annotations, subst, stats=None):
+        self.annotations = annotations
+        self.subst = subst
+        self.stats = stats
+        self.done = {}
+        self.types = {}
+
+    def type_of(self, node):
+        typ = self.types.get(node)
+        if typ is None:
+            typ = self.annotations[node]
+            if self.subst and not isinstance(typ, TypeScheme):
+                typ = _resolve(typ, self.subst, self.done, self.stats)
+            self.types[node] = typ
+        return typ
+
+    __getitem__ = type_of
+
+    def arg_types_of(self, node):
+        return {name: _resolve(typ, self.subst, self.done, self.stats) if self.subst else typ
+                for name, typ in self.annotations.arg_types[node].items()}
+
+    def resolve_all(self, node):
+        for node in _preorder(node, self.annotations.schemes):
+            self.type_of(node)
+        return self
+
+
+def resolve_all(node, annotations, subst, stats=None):
+    return ResolvedTypes(annotations, subst, stats).resolve_all(node)
+
+
+# Type variables of `typ` in order of first occurrence, return type first.
+def typevars(typ):
+    seen = set()
+    stack = [typ]
+    while stack:
+        t = stack.pop()
+        if isinstance(t, TypeVar):
+            if t not in seen:
+                seen.add(t)
+                yield t
+        elif isinstance(t, FuncType):
+            stack.extend(reversed(t.argtypes))
+            stack.append(t.rettype)
+
+
+def rename_typevars(typ):
+    namemap = {}
+    for t in typevars(typ):
+        n = len(namemap)
+        namemap[t] = TypeVar(n, chr(ord("a") + n))
+    return apply_unifier(typ, namemap)
+
+
+def _stable_hash(typ):
+    return hashlib.blake2b(str(typ).encode(), digest_size=16).hexdigest()
+
+
+# Process-wide table of canonical signatures. Alpha-equivalent types share
+# one canonical term, their rename_typevars() form; terms are interned, so a
+# signature shared by many declarations is stored once and two signatures
+# are compared with `is`. Each canonical term also gets a hash that, unlike
+# hash(), is the same in every process. Both tables hold their terms weakly:
+# an entry lasts as long as the signature is in use somewhere, so a
+# long-running process does not accumulate every signature it has seen.
+#   canon    FuncType -> its canonical term, if not itself, so renaming is
+#            done once
+#   hashes   canonical term -> stable hash
+#   hits     lookups that found the signature already stored
+class SignatureCache:
+    def __init__(self):
+        self.canon = weakref.WeakKeyDictionary()
+        self.hashes = weakref.WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+
+    def canonical(self, typ):
+        if typ in self.hashes:
+            self.hits += 1
             return typ
-    elif isinstance(typ, FuncType):
-        newargtypes = [apply_unifier(arg, subst) for arg in typ.argtypes]
-        return FuncType(newargtypes,
-                        apply_unifier(typ.rettype, subst))
-    else:
-        return None
+        if isinstance(typ, FuncType):
+            canon = self.canon.get(typ)
+            if canon is None:
+                canon = rename_typevars(typ)
+                if canon is not typ:
+                    self.canon[typ] = canon
+        else:
+            canon = rename_typevars(typ)
+        if canon in self.hashes:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.hashes[canon] = _stable_hash(canon)
+        return canon
 
+    def stable_hash(self, typ):
+        return self.hashes[self.canonical(typ)]
 
-def get_expression_type(expr, subst, rename_types=False):
-    typ = apply_unifier(expr._type, subst)
+    def __len__(self):
+        return len(self.hashes)
+
+    def clear(self):
+        self.__init__()
+
+
+signatures = SignatureCache()
+
+
+def canonical_type(typ):
+    return signatures.canonical(typ)
+
+
+def type_hash(typ):
+    return signatures.stable_hash(typ)
+
+
+def alpha_equivalent(typ_x, typ_y):
+    return canonical_type(typ_x) is canonical_type(typ_y)
+
+
+def instantiate(scheme, ctx=None):
+    if ctx is None:
+        ctx = _default_context
+    ctx.stats.count("instantiations")
+    return apply_unifier(scheme.typ,
+                         {t: _get_fresh_typevar(ctx) for t in scheme.quantified},
+                         ctx.stats)
+
+
+# Quantifies the variables of `typ` created above the current level; no
+# environment scan is needed, so this is linear in the size of the type.
+def generalize(typ, subst, ctx=None):
+    if ctx is None:
+        ctx = _default_context
+    typ = apply_unifier(typ, subst, ctx.stats)
+    return TypeScheme([t for t in typevars(typ) if ctx.typevar_level(t) > ctx.level],
+                      typ)
+
+
+# A scheme quantifying every variable of a closed signature.
+def close_over(typ):
+    return TypeScheme(typevars(typ), typ)
+
+
+def get_expression_type(expr, annotations, subst, rename_types=False, ctx=None):
+    typ = apply_unifier(annotations[expr], subst, None if ctx is None else ctx.stats)
     if rename_types:
-        namecounter = itertools.count(start=0)
-        namemap = {}
-        def rename_type(typ):
-            nonlocal namecounter
-            if isinstance(typ, TypeVar):
-                if typ.name in namemap:
-                    typ.name = namemap[typ.name]
-                else:
-                    name = chr(ord("a") + next(namecounter))
-                    namemap[typ.name] = name
-                    namemap[name] = name
-                    typ.name = namemap[typ.name]
-            elif isinstance(typ, FuncType):
-                rename_type(typ.rettype)
-                for argtyp in typ.argtypes:
-                    rename_type(argtyp)
-        rename_type(typ)
+        typ = rename_typevars(typ)
     return typ
+
+
+# `env` seen as a mapping to closed type schemes, each built on first lookup,
+# so a large env such as an interface file is only read where it is used.
+class _ClosedSignatures:
+    def __init__(self, env):
+        self.env = env
+        self.schemes = {}
+
+    def __contains__(self, name):
+        return name in self.env
+
+    def __getitem__(self, name):
+        scheme = self.schemes.get(name)
+        if scheme is None:
+            scheme = self.schemes[name] = close_over(self.env[name])
+        return scheme
+
+
+# Infers a group of mutually recursive declarations. `env` maps the names of
+# already inferred declarations to their closed signatures, which are
+# instantiated afresh at every use. Within the group declarations are
+# monomorphic; they are generalised once the group is solved. Each call runs
+# in its own InferenceContext unless `ctx` is given; `subtrees` is passed to
+# a new one. Returns a dict of canonical signatures (see SignatureCache), or
+# raises TypingError. With `simplify`, the equations go through
+# simplify_equations() before solving.
+def infer_decls(decls, env=None, ctx=None, solver="deferred", simplify=False,
+                subtrees=None):
+    if env is None:
+        env = {}
+    if ctx is None:
+        ctx = InferenceContext(subtrees=subtrees)
+    symtab = environment.Environment(_ClosedSignatures(env))
+    annotations = Annotations()
+
+    def equations():
+        for decl in decls:
+            yield from iter_equations(decl.expr, annotations, ctx)
+            yield TypeEquation(own[decl.name], annotations[decl.expr], decl)
+
+    ctx.enter_level()
+    try:
+        own = {decl.name: _get_fresh_typevar(ctx) for decl in decls}
+        symtab.push_scope(own)
+        with ctx.stats.phase("assign"):
+            for decl in decls:
+                assign_typenames(decl.expr, symtab, annotations, ctx)
+        eqs = equations()
+        if simplify:
+            with ctx.stats.phase("simplify"):
+                eqs = simplify_equations(eqs, ctx.stats)
+        with ctx.stats.phase("solve"):
+            subst, conflict = unify_stream(eqs, solver, ctx)
+    finally:
+        ctx.leave_level()
+    if conflict is not None:
+        raise TypingError(f"cannot unify {conflict}")
+    return {decl.name: canonical_type(generalize(own[decl.name], subst, ctx).typ)
+            for decl in decls}